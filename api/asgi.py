@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Asynchroniczny (ASGI) tryb serwowania aplikacji.
+
+/api/analyze i /api/get-matches są obsługiwane przez korutyny: zapytania do
+Perplexity idą przez httpx.AsyncClient, a do Gemini przez generate_content_async,
+więc setki trwających wywołań modeli kosztują korutyny, a nie wątki.
+Pozostałe trasy trafiają bez zmian do aplikacji Flask (WsgiToAsgi).
+
+Uruchomienie: uvicorn api.asgi:app --port 5001
+"""
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qs
+
+import httpx
+import requests
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.http import http_date, parse_date, parse_etags
+
+from api import index
+from api.index import (
+    HTTP_CONNECT_TIMEOUT,
+    PERPLEXITY_API_URL,
+    PERPLEXITY_TIMEOUT,
+    CircuitOpen,
+    _analysis_cache,
+    _analysis_cache_key,
+    _analysis_cache_model,
+    _analysis_error,
+    _begin_request_timing,
+    _breaker,
+    _call_model_hedged,
+    _encode_json_response,
+    _end_request_timing,
+    _gemini_breaker,
+    _gemini_response_data,
+    _hedge_alternate,
+    _latency_window,
+    _llm_labels,
+    _lookup_analysis,
+    _parse_matches_query,
+    _perplexity_request,
+    _perplexity_response_data,
+    _prepare_gemini_request,
+    _public_job,
+    _query_matches,
+    _server_timing_note,
+    _size_timing,
+    _stale_analysis,
+    _submit_analysis_job,
+    _timed,
+    _validate_analysis_request,
+)
+
+# Limit jednoczesnych połączeń współdzielonego klienta httpx
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.environ.get('ASYNC_HTTP_MAX_CONNECTIONS', '200'))
+
+_flask_app = WsgiToAsgi(index.app)
+_http_client = None
+
+def _get_http_client():
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(PERPLEXITY_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                                max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS),
+            headers={'User-Agent': 'Vercel-Function-Football-Scraper/1.0'},
+        )
+    return _http_client
+
+class _AsyncSingleFlight:
+    """Odpowiednik _SingleFlight dla korutyn - identyczne równoległe wywołania czekają na jedno."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, coro_fn):
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result, False
+        except Exception as e:
+            future.set_exception(e)
+            # Oznacz wyjątek jako odebrany, jeśli nikt inny nie czekał
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self._calls.pop(key, None)
+
+_analysis_flight = _AsyncSingleFlight()
+
+async def _cached_analysis(model_choice, prompt, use_grounding, call):
+    """Asynchroniczna wersja index._cached_analysis - korzysta z tego samego cache wyników.
+
+    Cache ma magazyn SQLite (CACHE_DB_PATH), więc odczyt i zapis idą w wątku, a nie w pętli zdarzeń.
+    """
+    key = _analysis_cache_key(model_choice, prompt, use_grounding)
+    cached, stale_entry = await asyncio.to_thread(_lookup_analysis, key, use_grounding)
+    if cached is not None:
+        return cached
+
+    async def _compute():
+        response_data = await call()
+        await asyncio.to_thread(_analysis_cache.set, key, response_data)
+        return response_data
+
+    try:
+        response_data, shared = await _analysis_flight.do(key, _compute)
+    except CircuitOpen:
+        stale = _stale_analysis(stale_entry)
+        if stale is None:
+            raise
+        return stale
+    return response_data, {'status': 'coalesced' if shared else 'miss', 'age_s': 0}
+
+async def _call_perplexity_api(prompt, api_key):
+    payload, headers = _perplexity_request(prompt, api_key)
+    with _breaker(f"perplexity/{payload['model']}").guard():
+        try:
+            response = await _get_http_client().post(PERPLEXITY_API_URL, json=payload, headers=headers)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            # Bezpiecznik ocenia błędy w postaci wyjątków requests
+            raise _as_requests_error(e) from e
+    return _perplexity_response_data(response.json())
+
+async def _call_gemini_api(prompt, api_key, use_grounding=False):
+    try:
+        if index.genai is None:
+            # Zwykle załadowane przy starcie (lifespan) - import trwa sekundy i nie może blokować pętli zdarzeń
+            await asyncio.to_thread(index._load_google_ai)
+        model, optimized_prompt, generation_config = _prepare_gemini_request(prompt, api_key, use_grounding, use_async=True)
+        with _gemini_breaker(model).guard():
+            response = await model.generate_content_async(
+                optimized_prompt,
+                generation_config=generation_config,
+                request_options={"timeout": 45}  # 45 sekund timeout
+            )
+        return _gemini_response_data(response)
+    except Exception as e:
+        if "timeout" in str(e).lower():
+            raise Exception("Zapytanie przekroczyło limit czasu. Spróbuj ponownie lub użyj Perplexity.")
+        raise e
+
+def _as_requests_error(e):
+    """Tłumaczy wyjątki httpx na odpowiedniki z requests, żeby użyć wspólnego _analysis_error."""
+    if isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return requests.exceptions.Timeout(str(e))
+    if isinstance(e, httpx.HTTPStatusError):
+        response = requests.models.Response()
+        response.status_code = e.response.status_code
+        response._content = e.response.content
+        return requests.exceptions.HTTPError(str(e), response=response)
+    if isinstance(e, httpx.TransportError):
+        return requests.exceptions.ConnectionError(str(e))
+    return e
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+def _request_headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+
+async def _send_response(send, request_headers, status, body=b'', headers=None):
+    response_headers = dict(headers or {})
+    if body:
+        response_headers.setdefault('Content-Type', 'application/json')
+    response_headers['Content-Length'] = str(len(body))
+    # Jak flask_cors z domyślną konfiguracją CORS(app)
+    if 'origin' in request_headers:
+        response_headers['Access-Control-Allow-Origin'] = '*'
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response_headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def _json_body(data):
+    # Te same bajty co jsonify(), więc ETag jest identyczny w obu trybach
+    return index.app.json.response(data).get_data()
+
+async def _analyze(scope, receive, send):
+    request_headers = _request_headers(scope)
+    try:
+        body = json.loads(await _read_body(receive) or b'null')
+    except ValueError:
+        body = None
+    # Walidacja szuka meczu w cache list (SQLite), a zadanie zapisuje się w magazynie zadań - w wątku
+    prompt, model_choice, api_key, use_grounding, error = await asyncio.to_thread(_validate_analysis_request, body)
+    if error:
+        return await _send_response(send, request_headers, error[1], _json_body({'error': error[0]}))
+
+    alternate = _hedge_alternate(model_choice, body)
+    if body.get('async'):
+        job = await asyncio.to_thread(_submit_analysis_job, model_choice, prompt, api_key, use_grounding, alternate)
+        return await _send_response(send, request_headers, 202, _json_body(
+            {**_public_job(job), 'poll_url': f"/api/jobs/{job['job_id']}"}))
+    if alternate:
+        # Zabezpieczanie korzysta z przerywalnych wywołań strumieniowych w wątkach - jak w trybie WSGI
+        hedged_call = lambda: asyncio.to_thread(_call_model_hedged, model_choice, prompt, api_key, use_grounding, alternate)
+        return await _respond_analysis(send, request_headers, _analysis_cache_model(model_choice, alternate),
+                                       prompt, use_grounding, hedged_call)
+    if model_choice == 'gemini':
+        call = lambda: _call_gemini_api(prompt, api_key, use_grounding)
+    else:
+        call = lambda: _call_perplexity_api(prompt, api_key)
+
+    async def timed_call():
+        started = time.monotonic()
+        with _timed('llm', 'llm_request', **_llm_labels(model_choice, use_grounding, 'async')):
+            response_data = await call()
+        # Ta sama próbka co w _call_model - z niej liczony jest próg zabezpieczania
+        _latency_window(model_choice, use_grounding).record(time.monotonic() - started)
+        return response_data
+    await _respond_analysis(send, request_headers, model_choice, prompt, use_grounding, timed_call)
+
+async def _respond_analysis(send, request_headers, model_choice, prompt, use_grounding, call):
+    try:
+        print(f"Rozpoczynam analizę z modelem: {model_choice}")
+        response_data, cache_info = await _cached_analysis(model_choice, prompt, use_grounding, call)
+        print(f"Analiza zakończona pomyślnie (cache: {cache_info['status']})")
+    except Exception as e:
+        message, status = _analysis_error(_as_requests_error(e))
+        return await _send_response(send, request_headers, status, _json_body({"error": message}))
+    await _send_response(send, request_headers, 200, _json_body({**response_data, 'cache': cache_info}),
+                         {'X-Cache': cache_info['status'].upper()})
+
+async def _get_matches(scope, receive, send):
+    request_headers = _request_headers(scope)
+    query_args = {key: values[0] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+    try:
+        query = _parse_matches_query(query_args)
+    except ValueError as e:
+        return await _send_response(send, request_headers, 400, _json_body({'error': str(e)}))
+    # Listy meczów są w cache i łączone przez _SingleFlight, więc wątek jest potrzebny tylko przy odświeżeniu
+    data, headers, stored_at = await asyncio.to_thread(_query_matches, query)
+
+    body, encoding, etag, stats = _encode_json_response(data, request_headers.get('accept-encoding'))
+    headers.update({
+        'ETag': f'W/"{etag}"' if encoding else f'"{etag}"',
+        'Last-Modified': http_date(int(stored_at)),
+        'Vary': 'Accept-Encoding',
+    })
+    _server_timing_note(_size_timing(stats))
+    if encoding:
+        headers['Content-Encoding'] = encoding
+
+    if_none_match = request_headers.get('if-none-match')
+    if_modified_since = parse_date(request_headers.get('if-modified-since'))
+    if if_none_match is not None:
+        not_modified = parse_etags(if_none_match).contains_weak(etag)
+    else:
+        not_modified = if_modified_since is not None and int(stored_at) <= if_modified_since.timestamp()
+    if not_modified:
+        headers.pop('Content-Encoding', None)
+        return await _send_response(send, request_headers, 304, b'', headers)
+    await _send_response(send, request_headers, 200, body, headers)
+
+_ASYNC_ROUTES = {
+    ('POST', '/api/analyze'): _analyze,
+    ('GET', '/api/get-matches'): _get_matches,
+}
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Biblioteki Google AI ładujemy przy starcie, a nie przy pierwszym wywołaniu Gemini w pętli zdarzeń
+                await asyncio.to_thread(index._load_google_ai)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if _http_client is not None:
+                    await _http_client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    handler = _ASYNC_ROUTES.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+    if handler is None:
+        return await _flask_app(scope, receive, send)
+    await _timed_handler(handler, scope, receive, send)
+
+async def _timed_handler(handler, scope, receive, send):
+    """Server-Timing i http_request_duration_seconds dla tras asynchronicznych - jak hooki Flask w index.py.
+
+    Każde zapytanie ASGI to osobne zadanie asyncio z własną kopią kontekstu, więc pomiary się nie mieszają.
+    """
+    _begin_request_timing()
+
+    async def send_with_timing(message):
+        if message['type'] == 'http.response.start':
+            server_timing = _end_request_timing(scope['path'], scope['method'], message['status'])
+            if server_timing is not None:
+                message = {**message, 'headers': list(message.get('headers', [])) +
+                           [(b'server-timing', server_timing.encode('latin-1'))]}
+        await send(message)
+
+    await handler(scope, receive, send_with_timing)
@@ -1,37 +1,328 @@
-from flask import Flask, jsonify, request, send_from_directory
-from flask_cors import CORS
 import os
+import sys
+import time
+_STARTUP_STARTED = time.perf_counter()
+# STARTUP_PROFILE=1: mierzy czas importu każdego modułu i czas do pierwszego zapytania
+STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE') == '1'
+
+class _ImportProfiler:
+    """Finder na sys.meta_path, który mierzy czas wykonania każdego importowanego modułu."""
+
+    def __init__(self):
+        self.timings = {}
+        self._stack = []
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, name, self)
+                return spec
+        return None
+
+    def report(self, limit=20):
+        modules = sorted(self.timings.items(), key=lambda item: item[1]['self_ms'], reverse=True)[:limit]
+        return [{'module': name, **timing} for name, timing in modules]
+
+class _TimedLoader:
+    def __init__(self, loader, name, profiler):
+        self._loader = loader
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._profiler._stack
+        stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += total
+            self._profiler.timings[self._name] = {'self_ms': round((total - children) * 1000, 2),
+                                                  'total_ms': round(total * 1000, 2)}
+
+_import_profiler = None
+if STARTUP_PROFILE:
+    _import_profiler = _ImportProfiler()
+    sys.meta_path.insert(0, _import_profiler)
+
+import importlib.util
+from flask import Flask, Response, jsonify, request, send_from_directory, stream_with_context
+from flask_cors import CORS
 import requests
-from datetime import date, datetime
+from requests.adapters import HTTPAdapter
+import threading
+import contextvars
+import hashlib
+import hmac
+import random
+import uuid
+import sqlite3
+import tempfile
+import re
+import gzip
+import unicodedata
+from contextlib import closing, contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 import json
-print("Vercel: api/index.py został załadowany.") # Dodano dla debugowania
+from werkzeug.http import parse_accept_header
+
+# Szybszy enkoder JSON i kompresja brotli są opcjonalne - bez nich lista meczów używa json i gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Biblioteki Google AI są ładowane dopiero przy pierwszej analizie Gemini (_load_google_ai),
+# bo ich import dominuje czas zimnego startu, a /api/get-matches i strona główna ich nie potrzebują.
+# find_spec sprawdza tylko, czy pakiet jest zainstalowany - bez jego importowania.
 try:
-    import google.generativeai as genai
-    from google.api_core import exceptions as google_exceptions
-    from google.generativeai.types import generation_types, Tool
-    GOOGLE_AI_AVAILABLE = True
-except ImportError as e:
-    print(f"Warning: Google AI libraries not available: {e}")
+    GOOGLE_AI_AVAILABLE = importlib.util.find_spec('google.generativeai') is not None
+except (ImportError, ValueError):
     GOOGLE_AI_AVAILABLE = False
-    # Fallback classes for error handling
-    class MockGoogleExceptions:
-        PermissionDenied = Exception
-        NotFound = Exception
-        InvalidArgument = Exception
-    google_exceptions = MockGoogleExceptions()
-    
-    class MockGenerationTypes:
-        class BlockedPromptException(Exception):
-            pass
-    generation_types = MockGenerationTypes()
-from dotenv import load_dotenv
-load_dotenv()
+if not GOOGLE_AI_AVAILABLE:
+    print("Warning: Google AI libraries not available")
+
+# Zastępcze klasy wyjątków, dopóki biblioteki nie są załadowane - nigdy nie są rzucane,
+# więc isinstance() w _analysis_error nie dopasuje do nich błędów innych dostawców
+class _GoogleExceptionsFallback:
+    class PermissionDenied(Exception):
+        pass
+
+    class NotFound(Exception):
+        pass
+
+    class InvalidArgument(Exception):
+        pass
+
+class _GenerationTypesFallback:
+    class BlockedPromptException(Exception):
+        pass
+
+genai = None
+glm = None
+google_exceptions = _GoogleExceptionsFallback()
+generation_types = _GenerationTypesFallback()
+_google_ai_lock = threading.Lock()
+
+def _load_google_ai():
+    """Importuje biblioteki Google AI przy pierwszym użyciu (raz na proces)."""
+    global genai, glm, google_exceptions, generation_types
+    if genai is not None:
+        return
+    with _google_ai_lock:
+        if genai is not None:
+            return
+        started = time.perf_counter()
+        import google.generativeai as _genai
+        from google.api_core import exceptions as _google_exceptions
+        from google.generativeai.types import generation_types as _generation_types
+        from google.ai import generativelanguage as _glm
+        google_exceptions, generation_types, glm = _google_exceptions, _generation_types, _glm
+        genai = _genai
+        print(f"Biblioteki Google AI załadowane w {(time.perf_counter() - started) * 1000:.0f} ms")
+
+# Na Vercel zmienne środowiskowe są ustawione w panelu, plik .env jest potrzebny tylko lokalnie
+if not os.environ.get('VERCEL'):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 # Konfiguracja dla Vercel
 template_dir = os.path.dirname(os.path.abspath(__file__))
 app = Flask(__name__, template_folder=template_dir)
 CORS(app)
 
+# Czas importu samego modułu (do utworzenia aplikacji) i raport profilera startu
+STARTUP_IMPORT_MS = round((time.perf_counter() - _STARTUP_STARTED) * 1000, 1)
+_startup_report = None
+
+@app.before_request
+def _record_first_request():
+    global _startup_report
+    if _startup_report is not None or not STARTUP_PROFILE:
+        return
+    _startup_report = {
+        'import_ms': STARTUP_IMPORT_MS,
+        'time_to_first_request_ms': round((time.perf_counter() - _STARTUP_STARTED) * 1000, 1),
+        'first_request': request.path,
+        'google_ai_loaded': genai is not None,
+        'slowest_modules': _import_profiler.report(),
+    }
+    print(f"Profil startu: {json.dumps(_startup_report, ensure_ascii=False)}")
+
+# Progi histogramów czasu (w sekundach) - od parsowania JSON po odpowiedzi modeli z groundingiem
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class _Metrics:
+    """Liczniki i histogramy w pamięci procesu, eksportowane w formacie tekstowym Prometheusa."""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = []
+        for name, value in pairs:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{name}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in self._histograms.items())
+        lines, described = [], set()
+
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self._help.get(name, (kind, name))[1]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            header(name, 'histogram')
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+_metrics = _Metrics()
+_metrics.describe('http_request_duration_seconds', 'histogram', 'Czas obsługi zapytania HTTP (bez strumieniowanej treści)')
+_metrics.describe('http_errors_total', 'counter', 'Odpowiedzi HTTP z kodem >= 400')
+_metrics.describe('span_duration_seconds', 'histogram', 'Czas etapów obsługi zapytania (Server-Timing)')
+_metrics.describe('football_data_request_duration_seconds', 'histogram', 'Czas zapytań do football-data.org')
+_metrics.describe('football_data_request_errors_total', 'counter', 'Błędy zapytań do football-data.org')
+_metrics.describe('openligadb_request_duration_seconds', 'histogram', 'Czas zapytań do OpenLigaDB')
+_metrics.describe('openligadb_request_errors_total', 'counter', 'Błędy zapytań do OpenLigaDB')
+_metrics.describe('llm_request_duration_seconds', 'histogram', 'Czas wywołań modeli językowych')
+_metrics.describe('llm_request_errors_total', 'counter', 'Błędy wywołań modeli językowych')
+
+# Pomiary bieżącego zapytania dla nagłówka Server-Timing: {'spans': nazwa -> suma sekund, 'notes': [...],
+# 'started': ...}; poza zapytaniem - None. ContextVar (a nie threading.local), bo kontekst przechodzi do
+# pul wątków przez _submit_in_context / asyncio.to_thread i jest osobny dla każdej korutyny w trybie ASGI
+_request_timing = contextvars.ContextVar('request_timing', default=None)
+# Etapy z wątków roboczych jednego zapytania trafiają do wspólnego słownika
+_request_timing_lock = threading.Lock()
+
+@contextmanager
+def _timed(span, metric=None, **labels):
+    """Mierzy etap: dopisuje go do Server-Timing bieżącego zapytania i do histogramów /api/metrics.
+
+    Z metric='llm_request' czas trafia też do llm_request_duration_seconds, a wyjątek
+    zwiększa llm_request_errors_total (z etykietą error = nazwa klasy wyjątku).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        if metric:
+            _metrics.inc(f'{metric}_errors_total', error=type(e).__name__, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        timing = _request_timing.get()
+        if timing is not None:
+            with _request_timing_lock:
+                timing['spans'][span] = timing['spans'].get(span, 0.0) + elapsed
+        _metrics.observe('span_duration_seconds', elapsed, span=span)
+        if metric:
+            _metrics.observe(f'{metric}_duration_seconds', elapsed, **labels)
+
+def _submit_in_context(executor, fn, *args):
+    """executor.submit w kopii bieżącego kontekstu - etapy mierzone w wątku roboczym trafiają do Server-Timing zapytania."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+def _server_timing_note(entry):
+    """Dopisuje do Server-Timing bieżącego zapytania wpis bez czasu trwania, np. size;desc="..."."""
+    timing = _request_timing.get()
+    if timing is not None:
+        with _request_timing_lock:
+            timing['notes'].append(entry)
+
+def _begin_request_timing():
+    _request_timing.set({'spans': {}, 'notes': [], 'started': time.perf_counter()})
+
+def _end_request_timing(route, method, status):
+    """Kończy pomiar zapytania: zapisuje metryki HTTP i zwraca wartość nagłówka Server-Timing (albo None)."""
+    timing = _request_timing.get()
+    if timing is None:
+        return None
+    _request_timing.set(None)
+    elapsed = time.perf_counter() - timing['started']
+    _metrics.observe('http_request_duration_seconds', elapsed, route=route, method=method)
+    if status >= 400:
+        _metrics.inc('http_errors_total', route=route, method=method, status=status)
+    with _request_timing_lock:
+        timings = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timing['spans'].items()]
+        timings.extend(timing['notes'])
+    timings.append(f"total;dur={elapsed * 1000:.1f}")
+    return ', '.join(timings)
+
+@app.before_request
+def _start_request_timing():
+    _begin_request_timing()
+
+@app.after_request
+def _finish_request_timing(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    server_timing = _end_request_timing(route, request.method, response.status_code)
+    if server_timing is not None:
+        response.headers['Server-Timing'] = server_timing
+    return response
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -47,11 +338,29 @@ def _parse_footballdata_org_response(data: dict, league_name: str) -> list:
                 'league': league_name, 'date': utc_date_str,
                 'home_team': match.get('homeTeam', {}).get('name', 'N/A'),
                 'away_team': match.get('awayTeam', {}).get('name', 'N/A'),
-                'status': match.get('status', 'SCHEDULED'), 'source': 'Football-Data.org'
+                'status': match.get('status', 'SCHEDULED'), 'source': 'Football-Data.org',
+                # Identyfikatory football-data.org - klucze danych o formie drużyn i bilansie bezpośrednim
+                'football_data_id': match.get('id'),
+                'home_team_id': match.get('homeTeam', {}).get('id'),
+                'away_team_id': match.get('awayTeam', {}).get('id'),
             })
         except (ValueError, TypeError): continue
     return matches
 
+def _parse_openligadb_response(data: list, league_name: str, date_from: str, date_to: str) -> list:
+    # /getmatchdata/<liga> zwraca całą bieżącą kolejkę - zostawiamy tylko mecze z zakresu dni (UTC)
+    matches = []
+    for match in data or []:
+        utc_date_str = match.get('matchDateTimeUTC')
+        if not utc_date_str or not date_from <= utc_date_str[:10] <= date_to: continue
+        matches.append({
+            'league': league_name, 'date': utc_date_str,
+            'home_team': (match.get('team1') or {}).get('teamName', 'N/A'),
+            'away_team': (match.get('team2') or {}).get('teamName', 'N/A'),
+            'status': 'FINISHED' if match.get('matchIsFinished') else 'SCHEDULED', 'source': 'OpenLigaDB'
+        })
+    return matches
+
 @app.route('/api/check-env-keys', methods=['GET'])
 def check_env_keys():
     """Sprawdza czy klucze API są ustawione w zmiennych środowiskowych"""
@@ -65,203 +374,2504 @@ def check_env_keys():
         'perplexity_key_preview': perplexity_key[:10] + '...' if perplexity_key else None
     })
 
-@app.route('/api/get-matches', methods=['GET'])
-def get_matches():
-    all_matches = []
-    session = requests.Session()
-    session.headers.update({'User-Agent': 'Vercel-Function-Football-Scraper/1.0'})
-    today_str = date.today().strftime('%Y-%m-%d')
-
-    FOOTBALL_DATA_API_KEY = os.environ.get('FOOTBALL_DATA_API_KEY')
-    if FOOTBALL_DATA_API_KEY:
-        competitions = {
-            'Premier League': 'PL',
-            'La Liga': 'PD',
-            'Serie A': 'SA',
-            'Bundesliga': 'BL1',
-            'Ligue 1': 'FL1',
-            'Primeira Liga': 'PPL'
-        }
-        headers = {'X-Auth-Token': FOOTBALL_DATA_API_KEY}
-        for league_name, code in competitions.items():
-            api_url = f"https://api.football-data.org/v4/competitions/{code}/matches?dateFrom={today_str}&dateTo={today_str}"
+# Adres API football-data.org (nadpisywany np. przez atrapę w benchmarku)
+FOOTBALL_DATA_API_URL = os.environ.get('FOOTBALL_DATA_API_URL', 'https://api.football-data.org/v4').rstrip('/')
+# Ligi pobierane z football-data.org (nazwa wyświetlana -> kod rozgrywek)
+COMPETITIONS = {
+    'Premier League': 'PL',
+    'La Liga': 'PD',
+    'Serie A': 'SA',
+    'Bundesliga': 'BL1',
+    'Ligue 1': 'FL1',
+    'Primeira Liga': 'PPL'
+}
+# Limit czasu (w sekundach) na pobranie jednej ligi oraz rozmiar puli wątków
+LEAGUE_TIMEOUT = float(os.environ.get('LEAGUE_TIMEOUT', '4'))
+MATCHES_MAX_WORKERS = int(os.environ.get('MATCHES_MAX_WORKERS', '6'))
+# Najdłuższy zakres dat w jednym zapytaniu /api/get-matches - cały zakres pobierany jest jednym zapytaniem na źródło
+MATCHES_MAX_DAYS = int(os.environ.get('MATCHES_MAX_DAYS', '7'))
+# Wspólna pula - zapytania, które przekroczyły termin, dokończą się w tle i nie blokują odpowiedzi
+_league_executor = ThreadPoolExecutor(max_workers=MATCHES_MAX_WORKERS, thread_name_prefix='league-fetch')
+
+# Wspólne klienty HTTP: rozmiar puli połączeń keep-alive, timeout połączenia i ponowienia
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3.05'))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '2'))
+HTTP_RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', '0.3'))
+_RETRY_STATUS_CODES = (502, 503, 504)
+
+class _UpstreamClient:
+    """Współdzielona sesja HTTP dla jednego hosta upstreamu.
+
+    Ciepła instancja ponownie używa połączeń keep-alive między zapytaniami.
+    Zapytania idempotentne są ponawiane z losowo rozrzuconym wykładniczym
+    opóźnieniem; pozostałe tylko wtedy, gdy połączenie w ogóle nie powstało.
+    """
+
+    def __init__(self, name, read_timeout, pool_size=HTTP_POOL_SIZE):
+        self.name = name
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'Vercel-Function-Football-Scraper/1.0'})
+        # pool_block=True: przy pełnej puli zapytanie czeka na wolne połączenie zamiast otwierać kolejne
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', self._adapter)
+        self.session.mount('http://', self._adapter)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {'requests': 0, 'retries': 0, 'errors': 0, 'pool_waits': 0}
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def request(self, method, url, timeout=None, idempotent=None, **kwargs):
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'OPTIONS')
+        timeout = (HTTP_CONNECT_TIMEOUT, timeout or self.read_timeout)
+        attempt = 0
+        while True:
+            with self._lock:
+                self._stats['requests'] += 1
+                if self._in_flight >= self.pool_size:
+                    self._stats['pool_waits'] += 1
+                self._in_flight += 1
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+                if not (idempotent and response.status_code in _RETRY_STATUS_CODES and attempt < HTTP_MAX_RETRIES):
+                    return response
+                response.close()
+            except requests.exceptions.ConnectTimeout:
+                if attempt >= HTTP_MAX_RETRIES:
+                    self._count('errors')
+                    raise
+            except requests.exceptions.ConnectionError:
+                if not idempotent or attempt >= HTTP_MAX_RETRIES:
+                    self._count('errors')
+                    raise
+            except requests.exceptions.RequestException:
+                self._count('errors')
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+            attempt += 1
+            self._count('retries')
+            time.sleep(HTTP_RETRY_BACKOFF * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        """Statystyki puli: nowe i ponownie użyte połączenia, oczekiwania na wolne połączenie."""
+        new_connections = served = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            new_connections += pool.num_connections
+            served += pool.num_requests
+        with self._lock:
+            stats = dict(self._stats, in_flight=self._in_flight)
+        return {**stats, 'pool_size': self.pool_size, 'new_connections': new_connections,
+                'reused_connections': max(0, served - new_connections)}
+
+# Tryb pobierania: 'bulk' - jedno zapytanie /v4/matches dla wszystkich lig, 'per-league' - osobno dla każdej ligi
+FOOTBALL_DATA_FETCH_MODE = os.environ.get('FOOTBALL_DATA_FETCH_MODE', 'bulk')
+# Darmowy plan football-data.org pozwala na ok. 10 zapytań na minutę
+FOOTBALL_DATA_RATE_PER_MINUTE = int(os.environ.get('FOOTBALL_DATA_RATE_PER_MINUTE', '10'))
+# Maksymalny czas (w sekundach) oczekiwania w kolejce na wolny token
+FOOTBALL_DATA_MAX_QUEUE_WAIT = float(os.environ.get('FOOTBALL_DATA_MAX_QUEUE_WAIT', '2'))
+
+class RateLimitExceeded(Exception):
+    """Brak wolnego limitu zapytań do upstreamu w dopuszczalnym czasie oczekiwania."""
+
+class _TokenBucket:
+    """Token bucket dla limitu zapytań upstreamu.
+
+    Lokalny stan jest korygowany nagłówkami X-Requests-Available-Minute
+    i X-RequestCounter-Reset, które football-data.org zwraca z każdą odpowiedzią.
+    """
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.tokens = float(rate_per_minute)
+        self.refill_per_sec = rate_per_minute / 60.0
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.refill_per_sec)
+        self._updated = now
+
+    def acquire(self, max_wait, reserve=0):
+        """Pobiera token, czekając najwyżej max_wait sekund. Zwraca False, jeśli się nie udało.
+
+        reserve tokenów zostaje w buckecie dla innych wywołujących (np. zadania w tle nie zabierają
+        ostatnich tokenów zapytaniom użytkowników).
+        """
+        deadline = time.monotonic() + max_wait
+        reserve = min(reserve, self.capacity - 1)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1 + reserve:
+                    self.tokens -= 1
+                    return True
+                wait = max(self.blocked_until - now, (1 + reserve - self.tokens) / self.refill_per_sec)
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def update_from_headers(self, headers, status_code):
+        """Synchronizuje bucket z licznikiem po stronie serwera."""
+        available = headers.get('X-Requests-Available-Minute')
+        reset = headers.get('X-RequestCounter-Reset')
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
             try:
-                response = session.get(api_url, headers=headers)
+                if available is not None:
+                    self.tokens = min(self.capacity, float(available))
+                if status_code == 429:
+                    self.tokens = 0.0
+                if reset is not None and self.tokens < 1:
+                    self.blocked_until = now + float(reset)
+            except ValueError:
+                pass
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return {'tokens': round(self.tokens, 2), 'blocked_for_s': round(max(0.0, self.blocked_until - now), 1)}
+
+class _SingleFlight:
+    """Łączy równoległe wywołania o tym samym kluczu w jedno zapytanie do upstreamu."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """Zwraca (wynik, shared) - shared=True, jeśli wynik pochodzi z cudzego wywołania."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            return future.result(), True
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+# Bezpieczniki upstreamów: po tylu kolejnych awariach obwód się otwiera, a po BREAKER_COOLDOWN sekundach
+# przepuszcza jedno próbne zapytanie. Nadpisania per upstream: np. BREAKER_GEMINI_COOLDOWN=120
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '3'))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', '30'))
+_metrics.describe('circuit_breaker_opened_total', 'counter', 'Otwarcia bezpieczników upstreamów')
+_metrics.describe('circuit_breaker_rejected_total', 'counter', 'Zapytania odrzucone przez otwarty bezpiecznik')
+
+class CircuitOpen(Exception):
+    """Bezpiecznik upstreamu jest otwarty - zapytanie odrzucone bez wywoływania upstreamu."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name}: obwód otwarty, kolejna próba za {retry_after:.0f}s")
+        self.name = name
+        self.upstream = name.split('/')[0]
+        self.retry_after = retry_after
+
+def _is_upstream_failure(e):
+    """Czy błąd świadczy o awarii upstreamu (timeout, brak połączenia, 5xx, 429), a nie o złym zapytaniu."""
+    if isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is not None and (e.response.status_code >= 500 or e.response.status_code == 429)
+    # Wyjątki google.api_core mają kod HTTP w atrybucie code
+    code = getattr(e, 'code', None)
+    if isinstance(code, int):
+        return code >= 500 or code == 429
+    return 'timeout' in str(e).lower() or 'deadline' in str(e).lower()
+
+class _CircuitBreaker:
+    """Bezpiecznik jednego upstreamu (np. ligi lub modelu): closed -> open -> half_open -> closed.
+
+    Błędy złego zapytania (4xx poza 429, zablokowany prompt) nie otwierają obwodu -
+    upstream odpowiedział, więc działa.
+    """
+
+    def __init__(self, name, failure_threshold, cooldown):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._rejected = 0
+
+    def _retry_after(self):
+        return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    def _allow(self):
+        with self._lock:
+            if self._state == 'open' and self._retry_after() <= 0:
+                self._state = 'half_open'
+            if self._state == 'closed' or (self._state == 'half_open' and not self._probe_in_flight):
+                self._probe_in_flight = self._state == 'half_open'
+                return True
+            self._rejected += 1
+            return False
+
+    def _record(self, failed):
+        with self._lock:
+            self._probe_in_flight = False
+            if not failed:
+                self._state, self._failures = 'closed', 0
+                return
+            self._failures += 1
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                if self._state != 'open':
+                    print(f"Bezpiecznik {self.name} otwarty po {self._failures} błędach (na {self.cooldown:.0f}s)")
+                    _metrics.inc('circuit_breaker_opened_total', breaker=self.name)
+                self._state, self._opened_at = 'open', time.monotonic()
+
+    @contextmanager
+    def guard(self):
+        """Otacza wywołanie upstreamu; przy otwartym obwodzie od razu rzuca CircuitOpen."""
+        if not self._allow():
+            _metrics.inc('circuit_breaker_rejected_total', breaker=self.name)
+            with self._lock:
+                retry_after = self._retry_after()
+            raise CircuitOpen(self.name, retry_after)
+        try:
+            yield
+        except RateLimitExceeded:
+            # Zapytanie nie dotarło do upstreamu (brak limitu) - bez oceny upstreamu, tylko zwolnienie próby
+            with self._lock:
+                self._probe_in_flight = False
+            raise
+        except Exception as e:
+            self._record(_is_upstream_failure(e))
+            raise
+        except BaseException:
+            # Przerwany odbiór (np. zamknięty strumień) - bez oceny upstreamu, tylko zwolnienie próby
+            with self._lock:
+                self._probe_in_flight = False
+            raise
+        else:
+            self._record(False)
+
+    def snapshot(self):
+        with self._lock:
+            if self._state == 'open' and self._retry_after() <= 0:
+                state = 'half_open'
+            else:
+                state = self._state
+            return {'state': state, 'failures': self._failures, 'rejected': self._rejected,
+                    'retry_after_s': max(1, round(self._retry_after())) if state == 'open' else 0}
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def _breaker(name):
+    """Bezpiecznik dla klucza 'upstream/liga' albo 'upstream/model' (tworzony przy pierwszym użyciu)."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            prefix = 'BREAKER_' + name.split('/')[0].upper().replace('-', '_')
+            breaker = _breakers[name] = _CircuitBreaker(
+                name,
+                int(os.environ.get(f'{prefix}_FAILURE_THRESHOLD', BREAKER_FAILURE_THRESHOLD)),
+                float(os.environ.get(f'{prefix}_COOLDOWN', BREAKER_COOLDOWN)))
+        return breaker
+
+def _breaker_states():
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.snapshot() for name, breaker in sorted(breakers.items())}
+
+_football_data_bucket = _TokenBucket(FOOTBALL_DATA_RATE_PER_MINUTE)
+_football_data_flight = _SingleFlight()
+_football_data_client = _UpstreamClient('football-data.org', read_timeout=LEAGUE_TIMEOUT)
+
+def _football_data_get(url, headers, league='all', max_wait=None, reserve=0):
+    """GET do football-data.org przez wspólny limiter; identyczne równoległe zapytania są łączone."""
+    def _do_request():
+        # Najpierw bezpiecznik - przy otwartym obwodzie nie zużywamy tokenu limitu
+        with _breaker(f'football-data/{league}').guard():
+            if not _football_data_bucket.acquire(FOOTBALL_DATA_MAX_QUEUE_WAIT if max_wait is None else max_wait, reserve):
+                _metrics.inc('football_data_request_errors_total', error=RateLimitExceeded.__name__, league=league)
+                raise RateLimitExceeded("Wyczerpany limit zapytań football-data.org")
+            with _timed('football-data', 'football_data_request', league=league):
+                response = _football_data_client.get(url, headers=headers)
+            _football_data_bucket.update_from_headers(response.headers, response.status_code)
+            response.raise_for_status()
+        with _timed('json-parse'):
+            return response.json()
+    return _football_data_flight.do(url, _do_request)[0]
+
+def _elapsed_ms(started):
+    return round((time.monotonic() - started) * 1000)
+
+def _league_error_status(league_name, error, started):
+    """Zamienia wyjątek z pobierania ligi na wpis statusu (timeout / rate_limited / error)."""
+    if isinstance(error, requests.exceptions.Timeout):
+        print(f"Timeout fetching {league_name} po {LEAGUE_TIMEOUT}s")
+        return {'status': 'timeout', 'latency_ms': _elapsed_ms(started)}
+    if isinstance(error, RateLimitExceeded):
+        print(f"Rate limit fetching {league_name}: {error}")
+        return {'status': 'rate_limited', 'latency_ms': _elapsed_ms(started)}
+    if isinstance(error, CircuitOpen):
+        print(f"Circuit open fetching {league_name}: {error}")
+        return {'status': 'circuit_open', 'retry_after_s': round(error.retry_after), 'latency_ms': _elapsed_ms(started)}
+    print(f"Error fetching {league_name}: {error}")
+    return {'status': 'error', 'error': str(error), 'latency_ms': _elapsed_ms(started)}
+
+def _fetch_league(league_name, code, headers, date_from, date_to):
+    """Pobiera mecze jednej ligi z zakresu dni i zwraca (mecze, status) - nigdy nie rzuca wyjątku."""
+    started = time.monotonic()
+    api_url = f"{FOOTBALL_DATA_API_URL}/competitions/{code}/matches?dateFrom={date_from}&dateTo={date_to}"
+    try:
+        data = _football_data_get(api_url, headers, league=code)
+        with _timed('parse-matches'):
+            matches = _parse_footballdata_org_response(data, league_name)
+        return matches, {'status': 'ok', 'matches': len(matches), 'latency_ms': _elapsed_ms(started)}
+    except Exception as e:
+        return [], _league_error_status(league_name, e, started)
+
+def _fetch_leagues_concurrently(leagues, fetch_league):
+    """Wywołuje fetch_league(nazwa, kod) -> (mecze, status) dla lig równolegle; każda liga ma własny termin LEAGUE_TIMEOUT."""
+    started = time.monotonic()
+    futures = {
+        league_name: _submit_in_context(_league_executor, fetch_league, league_name, code)
+        for league_name, code in leagues.items()
+    }
+    all_matches, league_status = [], {}
+    for league_name, future in futures.items():
+        # Wszystkie ligi startują razem, więc termin liczymy od wspólnego początku
+        remaining = max(0.0, LEAGUE_TIMEOUT - (time.monotonic() - started))
+        try:
+            matches, status = future.result(timeout=remaining)
+        except FuturesTimeoutError:
+            future.cancel()
+            print(f"Timeout fetching {league_name}: brak odpowiedzi w {LEAGUE_TIMEOUT}s")
+            matches, status = [], {'status': 'timeout', 'latency_ms': _elapsed_ms(started)}
+        all_matches.extend(matches)
+        league_status[league_name] = status
+    return all_matches, league_status
+
+def _fetch_all_leagues(headers, date_from, date_to):
+    """Pobiera wszystkie ligi football-data.org osobnymi zapytaniami, równolegle."""
+    return _fetch_leagues_concurrently(
+        COMPETITIONS, lambda league_name, code: _fetch_league(league_name, code, headers, date_from, date_to))
+
+def _fetch_all_leagues_bulk(headers, date_from, date_to):
+    """Pobiera wszystkie ligi jednym zapytaniem /v4/matches i rozdziela wynik według kodu rozgrywek.
+
+    Cały zakres dni to nadal jedno zapytanie - zakres 7 dni zużywa 1, a nie 7 zapytań z limitu na minutę.
+    """
+    started = time.monotonic()
+    codes = ','.join(COMPETITIONS.values())
+    api_url = f"{FOOTBALL_DATA_API_URL}/matches?competitions={codes}&dateFrom={date_from}&dateTo={date_to}"
+    try:
+        data = _football_data_get(api_url, headers)
+    except Exception as e:
+        status = _league_error_status('wszystkie ligi', e, started)
+        return [], {league_name: dict(status) for league_name in COMPETITIONS}
+
+    latency_ms = _elapsed_ms(started)
+    by_code = {code: [] for code in COMPETITIONS.values()}
+    for match in data.get('matches', []):
+        code = (match.get('competition') or {}).get('code')
+        if code in by_code:
+            by_code[code].append(match)
+
+    all_matches, league_status = [], {}
+    for league_name, code in COMPETITIONS.items():
+        with _timed('parse-matches'):
+            matches = _parse_footballdata_org_response({'matches': by_code[code]}, league_name)
+        all_matches.extend(matches)
+        league_status[league_name] = {'status': 'ok', 'matches': len(matches), 'latency_ms': latency_ms}
+    return all_matches, league_status
+
+# Adres API OpenLigaDB (bez klucza i bez limitu zapytań)
+OPENLIGADB_API_URL = os.environ.get('OPENLIGADB_API_URL', 'https://api.openligadb.de').rstrip('/')
+# Ligi pobierane z OpenLigaDB (nazwa wyświetlana -> skrót ligi)
+OPENLIGADB_LEAGUES = {
+    'Bundesliga': 'bl1',
+    '2. Bundesliga': 'bl2',
+}
+_openligadb_client = _UpstreamClient('openligadb', read_timeout=LEAGUE_TIMEOUT)
+# Czas (w sekundach), przez który pobrana bieżąca kolejka służy kolejnym dniom zakresu
+OPENLIGADB_MATCHDAY_TTL = int(os.environ.get('OPENLIGADB_MATCHDAY_TTL', '60'))
+_openligadb_flight = _SingleFlight()
+
+class _FixtureProvider:
+    """Źródło meczów dla /api/get-matches.
+
+    fetch(date_from, date_to) zwraca (mecze z całego zakresu dni, status lig) i nigdy nie rzuca wyjątku -
+    błąd trafia do statusu ligi. Podział na dni robi _load_matches.
+    """
+    name = ''
+
+    def leagues(self):
+        """Ligi źródła (nazwa wyświetlana -> kod), również część klucza cache."""
+        raise NotImplementedError
+
+    def fetch(self, date_from, date_to):
+        raise NotImplementedError
+
+class _FootballDataProvider(_FixtureProvider):
+    name = 'football-data'
+
+    def leagues(self):
+        return COMPETITIONS
+
+    def fetch(self, date_from, date_to):
+        api_key = os.environ.get('FOOTBALL_DATA_API_KEY')
+        if not api_key:
+            return [], {}
+        headers = {'X-Auth-Token': api_key}
+        if FOOTBALL_DATA_FETCH_MODE == 'per-league':
+            return _fetch_all_leagues(headers, date_from, date_to)
+        return _fetch_all_leagues_bulk(headers, date_from, date_to)
+
+class _OpenLigaDBProvider(_FixtureProvider):
+    name = 'openligadb'
+
+    def leagues(self):
+        return OPENLIGADB_LEAGUES
+
+    def fetch(self, date_from, date_to):
+        return _fetch_leagues_concurrently(
+            OPENLIGADB_LEAGUES,
+            lambda league_name, shortcut: self._fetch_league(league_name, shortcut, date_from, date_to))
+
+    def _fetch_league(self, league_name, shortcut, date_from, date_to):
+        started = time.monotonic()
+        try:
+            data = self._matchday(shortcut)
+            with _timed('parse-matches'):
+                matches = _parse_openligadb_response(data, league_name, date_from, date_to)
+            return matches, {'status': 'ok', 'matches': len(matches), 'latency_ms': _elapsed_ms(started)}
+        except Exception as e:
+            return [], _league_error_status(f"{league_name} (OpenLigaDB)", e, started)
+
+    def _matchday(self, shortcut):
+        """Bieżąca kolejka ligi - ta sama dla każdego dnia, więc odświeżanie kolejnych dni korzysta z jednego zapytania."""
+        entry = _openligadb_matchdays.get(shortcut)
+        if entry is not None and _openligadb_matchdays.is_fresh(entry[1]):
+            return entry[0]
+
+        def _do_request():
+            with _breaker(f'openligadb/{shortcut}').guard(), _timed('openligadb', 'openligadb_request', league=shortcut):
+                response = _openligadb_client.get(f"{OPENLIGADB_API_URL}/getmatchdata/{shortcut}")
                 response.raise_for_status()
-                all_matches.extend(_parse_footballdata_org_response(response.json(), league_name))
-            except Exception as e:
-                print(f"Error fetching {league_name}: {e}")
-    return jsonify(all_matches)
+            with _timed('json-parse'):
+                data = response.json()
+            _openligadb_matchdays.set(shortcut, data)
+            return data
+        return _openligadb_flight.do(shortcut, _do_request)[0]
 
-def _call_perplexity_api(prompt, api_key):
-    """Komunikuje się z API Perplexity."""
-    url = "https://api.perplexity.ai/chat/completions"
+_FIXTURE_PROVIDER_TYPES = {
+    'football-data': _FootballDataProvider,
+    'openligadb': _OpenLigaDBProvider,
+}
+# Włączone źródła meczów w kolejności pierwszeństwa - przy duplikacie zostają dane pierwszego źródła
+FIXTURE_PROVIDERS = [name.strip() for name in os.environ.get('FIXTURE_PROVIDERS', 'football-data,openligadb').split(',')
+                     if name.strip() in _FIXTURE_PROVIDER_TYPES]
+_fixture_providers = [_FIXTURE_PROVIDER_TYPES[name]() for name in FIXTURE_PROVIDERS]
+_fixture_executor = ThreadPoolExecutor(max_workers=max(1, len(_fixture_providers)), thread_name_prefix='fixture-provider')
+
+# Przedrostki klubowe pomijane przy porównywaniu nazw drużyn z różnych źródeł ("TSG 1899 Hoffenheim" = "TSG Hoffenheim")
+_TEAM_NAME_NOISE = {'fc', 'sc', 'sv', 'tsg', 'vfl', 'vfb', 'fsv', 'bv', 'cf', 'afc', 'ac', 'ssc', 'cd', 'ud', 'rc', 'sd', 'club'}
+
+# Niemieckie znaki zapisywane przez źródła na dwa sposoby ("München" / "Muenchen")
+_GERMAN_TRANSLITERATION = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+
+def _normalize_team_name(name):
+    name = (name or '').lower().translate(_GERMAN_TRANSLITERATION)
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    tokens = re.findall(r'[a-z0-9]+', ascii_name)
+    core = [token for token in tokens if token not in _TEAM_NAME_NOISE and not token.isdigit()]
+    return ' '.join(core or tokens)
+
+def _normalize_kickoff(date_str):
+    """Czas rozpoczęcia w UTC z dokładnością do minuty (daty bez strefy traktujemy jako UTC)."""
+    try:
+        kickoff = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+    except (ValueError, TypeError, AttributeError):
+        return date_str
+    if kickoff.tzinfo is None:
+        kickoff = kickoff.replace(tzinfo=timezone.utc)
+    return kickoff.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M')
+
+def _merge_matches(results):
+    """Łączy mecze z wielu źródeł w jednym przebiegu przez indeks (start, gospodarz, gość).
+
+    results to lista list meczów w kolejności pierwszeństwa źródeł; mecz zachowuje pola
+    z pierwszego źródła, a 'sources' wymienia wszystkie źródła, które go potwierdziły.
+    """
+    merged = {}
+    for matches in results:
+        for match in matches:
+            key = (_normalize_kickoff(match.get('date')),
+                   _normalize_team_name(match.get('home_team')),
+                   _normalize_team_name(match.get('away_team')))
+            existing = merged.get(key)
+            if existing is None:
+                # Krótki, stabilny identyfikator meczu - klient podaje go zamiast całego promptu
+                match_id = hashlib.sha1('|'.join(key).encode('utf-8')).hexdigest()[:12]
+                merged[key] = {**match, 'id': match_id, 'sources': [match['source']]}
+            elif match['source'] not in existing['sources']:
+                existing['sources'].append(match['source'])
+    return list(merged.values())
+
+def _merge_league_status(sources):
+    """Status ligi ze wszystkich źródeł: pierwszy poprawny (ok), a gdy żadnego - pierwszy błąd."""
+    leagues = {}
+    for provider_name, league_status in sources.items():
+        for league_name, status in league_status.items():
+            current = leagues.get(league_name)
+            if current is None or (current['status'] != 'ok' and status.get('status') == 'ok'):
+                leagues[league_name] = {**status, 'source': provider_name}
+    return leagues
+
+# Ścieżka do pliku SQLite współdzielonego przez ciepłe instancje i lokalne uruchomienia (puste = tylko pamięć).
+# Domyślnie katalog tymczasowy (na Vercel /tmp jest jedynym zapisywalnym), żeby zadania analiz przetrwały między wywołaniami
+CACHE_DB_PATH = os.environ.get('CACHE_DB_PATH', os.path.join(tempfile.gettempdir(), 'football-analysis-cache.sqlite3'))
+# Czas (w sekundach), po którym lista meczów jest odświeżana w tle
+MATCHES_CACHE_TTL = int(os.environ.get('MATCHES_CACHE_TTL', '300'))
+# Krótszy czas dla niepełnej listy (część lig z błędem, limitem lub otwartym bezpiecznikiem) - szybka ponowna próba
+MATCHES_PARTIAL_CACHE_TTL = int(os.environ.get('MATCHES_PARTIAL_CACHE_TTL', '30'))
+
+class _SqliteStore:
+    """Magazyn klucz -> JSON w tabeli SQLite."""
+
+    def __init__(self, path, table):
+        self.path = path
+        self.table = table
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT value, stored_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set(self, key, value, stored_at):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, value, stored_at) VALUES (?, ?, ?)",
+                         (key, json.dumps(value), stored_at))
+
+    def delete(self, key):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def purge_older_than(self, stored_at):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE stored_at < ?", (stored_at,))
+
+def _open_store(table):
+    """Zwraca magazyn SQLite dla tabeli albo None, jeśli CACHE_DB_PATH nie jest ustawione lub niedostępne."""
+    if not CACHE_DB_PATH:
+        return None
+    try:
+        return _SqliteStore(CACHE_DB_PATH, table)
+    except sqlite3.Error as e:
+        print(f"Cache SQLite niedostępny ({CACHE_DB_PATH}): {e}")
+        return None
+
+class _TTLCache:
+    """Cache w pamięci z TTL, opcjonalnym limitem wpisów (LRU) i magazynem trwałym.
+
+    get() zwraca także wpisy przeterminowane - o tym, czy wpis jest świeży,
+    decyduje wywołujący (is_fresh), co pozwala na stale-while-revalidate.
+    """
+
+    def __init__(self, ttl, store=None, max_entries=None):
+        self.ttl = ttl
+        self.store = store
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key, entry):
+        # Wywoływane z założoną blokadą
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if self.max_entries is not None:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Zwraca (wartość, stored_at) albo None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.store is not None:
+            try:
+                entry = self.store.get(key)
+            except sqlite3.Error as e:
+                print(f"Błąd odczytu cache SQLite: {e}")
+            if entry is not None:
+                with self._lock:
+                    self._remember(key, entry)
+        return entry
+
+    def set(self, key, value):
+        entry = (value, time.time())
+        with self._lock:
+            self._remember(key, entry)
+        if self.store is not None:
+            try:
+                self.store.set(key, value, entry[1])
+            except sqlite3.Error as e:
+                print(f"Błąd zapisu cache SQLite: {e}")
+        return entry
+
+    def is_fresh(self, stored_at, ttl=None):
+        return time.time() - stored_at < (self.ttl if ttl is None else ttl)
+
+_matches_cache = _TTLCache(MATCHES_CACHE_TTL, _open_store('matches_cache'))
+_openligadb_matchdays = _TTLCache(OPENLIGADB_MATCHDAY_TTL, max_entries=len(OPENLIGADB_LEAGUES))
+# Klucze, dla których trwa odświeżanie w tle - drugie odświeżanie tego samego klucza nie jest uruchamiane
+_matches_refreshing = set()
+_matches_refreshing_lock = threading.Lock()
+# Równoległe zapytania przy pustym cache czekają na jedno pobranie ze wszystkich źródeł
+_matches_flight = _SingleFlight()
+
+def _day_league_status(league_status, day_matches):
+    """Status lig dla jednego dnia zakresu - liczba meczów liczona dla tego dnia."""
+    counts = {}
+    for match in day_matches:
+        counts[match.get('league')] = counts.get(match.get('league'), 0) + 1
+    return {league: {**status, 'matches': counts.get(league, 0)} if status.get('status') == 'ok' else status
+            for league, status in league_status.items()}
+
+def _load_matches(day_strs):
+    """Pobiera mecze dni ze wszystkich źródeł równolegle, dzieli je na dni i łączy duplikaty.
+
+    Każde źródło pobiera cały zakres (od pierwszego do ostatniego dnia) jednym wywołaniem.
+    Zwraca {dzień: {'matches': [...], 'leagues': {liga: status}, 'sources': {źródło: {liga: status}}}}.
+    """
+    date_from, date_to = min(day_strs), max(day_strs)
+    futures = [(provider, _submit_in_context(_fixture_executor, provider.fetch, date_from, date_to))
+               for provider in _fixture_providers]
+    results = {day_str: [] for day_str in day_strs}
+    sources = {day_str: {} for day_str in day_strs}
+    for provider, future in futures:
+        matches, league_status = future.result()
+        by_day = {}
+        for match in matches:
+            by_day.setdefault(str(match.get('date', ''))[:10], []).append(match)
+        for day_str in day_strs:
+            results[day_str].append(by_day.get(day_str, []))
+            sources[day_str][provider.name] = _day_league_status(league_status, by_day.get(day_str, []))
+    payloads = {}
+    for day_str in day_strs:
+        with _timed('merge-matches'):
+            all_matches = _merge_matches(results[day_str])
+        payloads[day_str] = {'matches': all_matches, 'leagues': _merge_league_status(sources[day_str]),
+                             'sources': sources[day_str]}
+    return payloads
+
+def _matches_cache_key(day_str):
+    providers = ';'.join(f"{provider.name}:{','.join(provider.leagues().values())}" for provider in _fixture_providers)
+    return f"{day_str}|{providers}"
+
+def _keep_cached_leagues(payload, previous):
+    """Ligi bez poprawnej odpowiedzi (np. otwarty bezpiecznik) zachowują mecze z poprzedniego wyniku z cache."""
+    failed = {league for league, status in payload['leagues'].items() if status.get('status') != 'ok'}
+    if previous is None or not failed:
+        return payload
+    carried = [match for match in previous['matches'] if match.get('league') in failed]
+    if not carried:
+        return payload
+    leagues = dict(payload['leagues'])
+    for league in failed:
+        count = sum(1 for match in carried if match.get('league') == league)
+        if count:
+            leagues[league] = {**leagues[league], 'cached_matches': count}
+    return {**payload, 'matches': payload['matches'] + carried, 'leagues': leagues}
+
+def _matches_complete(payload):
+    """Czy wszystkie ligi wszystkich włączonych źródeł odpowiedziały poprawnie."""
+    return all(status.get('status') == 'ok'
+               for league_status in payload['sources'].values() for status in league_status.values())
+
+def _matches_ttl(payload):
+    return MATCHES_CACHE_TTL if _matches_complete(payload) else MATCHES_PARTIAL_CACHE_TTL
+
+def _store_matches(key, payload):
+    """Zapisuje wynik w cache tylko, jeśli choć jedna liga odpowiedziała poprawnie.
+
+    Niepełna lista jest świeża tylko przez MATCHES_PARTIAL_CACHE_TTL (_matches_ttl) - potem
+    odświeżanie w tle ponawia brakujące ligi, a _keep_cached_leagues zachowuje już pobrane mecze.
+    """
+    if any(status.get('status') == 'ok' for status in payload['leagues'].values()):
+        entry = _matches_cache.set(key, payload)
+        _prefetch_enrichment_in_background(payload['matches'])
+        return entry
+    return None
+
+def _refresh_matches_in_background(previous):
+    """Odświeża w tle dni {dzień: poprzedni payload} jednym pobraniem zakresu."""
+    with _matches_refreshing_lock:
+        keys = {day_str: _matches_cache_key(day_str) for day_str in previous}
+        keys = {day_str: key for day_str, key in keys.items() if key not in _matches_refreshing}
+        if not keys:
+            return
+        _matches_refreshing.update(keys.values())
+
+    def _refresh():
+        try:
+            for day_str, payload in _load_matches(sorted(keys)).items():
+                _store_matches(keys[day_str], _keep_cached_leagues(payload, previous[day_str]))
+        except Exception as e:
+            print(f"Błąd odświeżania meczów w tle: {e}")
+        finally:
+            with _matches_refreshing_lock:
+                _matches_refreshing.difference_update(keys.values())
+
+    threading.Thread(target=_refresh, name='matches-refresh', daemon=True).start()
+
+def _get_matches_range_cached(day_strs):
+    """Zwraca listę (payload, stored_at, stan cache) dla kolejnych dni - MISS, HIT albo STALE (odświeżany w tle).
+
+    Brakujące dni są pobierane razem, a przeterminowane odświeżane razem - jednym zapytaniem na źródło.
+    """
+    entries, stale, missing = {}, {}, []
+    for day_str in day_strs:
+        entry = _matches_cache.get(_matches_cache_key(day_str))
+        if entry is None:
+            missing.append(day_str)
+            continue
+        payload, stored_at = entry
+        if _matches_cache.is_fresh(stored_at, _matches_ttl(payload)):
+            entries[day_str] = (payload, stored_at, 'HIT')
+        else:
+            stale[day_str] = payload
+            entries[day_str] = (payload, stored_at, 'STALE')
+    if stale:
+        _refresh_matches_in_background(stale)
+    if missing:
+        def _load_and_store():
+            return {day_str: _store_matches(_matches_cache_key(day_str), payload) or (payload, time.time())
+                    for day_str, payload in _load_matches(missing).items()}
+        flight_key = '\n'.join(_matches_cache_key(day_str) for day_str in missing)
+        for day_str, (payload, stored_at) in _matches_flight.do(flight_key, _load_and_store)[0].items():
+            entries[day_str] = (payload, stored_at, 'MISS')
+    return [entries[day_str] for day_str in day_strs]
+
+def _get_matches_cached(day_str):
+    """Zwraca (payload, stored_at, stan cache) dla jednego dnia."""
+    return _get_matches_range_cached([day_str])[0]
+
+# Wzbogacanie analiz: forma drużyn i bilans bezpośredni z football-data.org dołączane do promptu,
+# dzięki czemu zwykła analiza Gemini bez groundingu ma aktualne dane w kilka sekund
+ENRICHMENT_ENABLED = os.environ.get('ENRICHMENT_ENABLED', '1') == '1'
+# Liczba ostatnich meczów drużyny i spotkań bezpośrednich w podsumowaniu
+ENRICHMENT_FORM_MATCHES = int(os.environ.get('ENRICHMENT_FORM_MATCHES', '5'))
+ENRICHMENT_H2H_MATCHES = int(os.environ.get('ENRICHMENT_H2H_MATCHES', '5'))
+# Pobieranie w tle może dłużej czekać na limit football-data.org, ale zostawia część tokenów zapytaniom użytkowników
+ENRICHMENT_MAX_QUEUE_WAIT = float(os.environ.get('ENRICHMENT_MAX_QUEUE_WAIT', '90'))
+ENRICHMENT_RESERVED_TOKENS = int(os.environ.get('ENRICHMENT_RESERVED_TOKENS', '2'))
+ENRICHMENT_MAX_ENTRIES = int(os.environ.get('ENRICHMENT_MAX_ENTRIES', '2048'))
+
+# team:<id> -> ostatnie mecze drużyny, h2h:<id>-<id> -> spotkania bezpośrednie; odświeżane raz dziennie
+_enrichment_cache = _TTLCache(24 * 3600, _open_store('enrichment_cache'), max_entries=ENRICHMENT_MAX_ENTRIES)
+_enrichment_lock = threading.Lock()
+# Future trwającego pobierania danych o formie - najwyżej jedno naraz, pre-warm może na nie poczekać
+_enrichment_inflight = None
+_enrichment_report = None
+_metrics.describe('prompt_enrichment_total', 'counter', 'Prompty analiz z danymi o formie drużyn (enriched=yes) i bez nich')
+
+def _enrichment_fresh(key):
+    """Wpis jest świeży, jeśli zapisano go dzisiaj - forma zmienia się dopiero po kolejnych meczach."""
+    entry = _enrichment_cache.get(key)
+    return entry is not None and datetime.fromtimestamp(entry[1]).date() == date.today()
+
+def _head2head_key(home_team_id, away_team_id):
+    low, high = sorted((int(home_team_id), int(away_team_id)))
+    return f"h2h:{low}-{high}"
+
+def _finished_matches(data):
+    """Zakończone mecze z odpowiedzi football-data.org w zwięzłej postaci, od najnowszego."""
+    finished = []
+    for match in data.get('matches', []):
+        full_time = (match.get('score') or {}).get('fullTime') or {}
+        if full_time.get('home') is None or full_time.get('away') is None:
+            continue
+        home, away = match.get('homeTeam') or {}, match.get('awayTeam') or {}
+        finished.append({
+            'date': (match.get('utcDate') or '')[:10],
+            'home_id': home.get('id'), 'home': home.get('shortName') or home.get('name'),
+            'away_id': away.get('id'), 'away': away.get('shortName') or away.get('name'),
+            'score': [full_time['home'], full_time['away']],
+        })
+    finished.sort(key=lambda match: match['date'], reverse=True)
+    return finished
+
+def _football_data_background_get(url, headers, league, deadline=None):
+    max_wait = ENRICHMENT_MAX_QUEUE_WAIT
+    if deadline is not None:
+        max_wait = max(0.0, min(max_wait, deadline - time.monotonic()))
+    return _football_data_get(url, headers, league=league, max_wait=max_wait, reserve=ENRICHMENT_RESERVED_TOKENS)
+
+def _prefetch_team_form(code, team_ids, headers, deadline=None):
+    """Jedno zapytanie o zakończone mecze ligi daje formę wszystkich jej drużyn; zwraca liczbę zapisanych drużyn."""
+    data = _football_data_background_get(f"{FOOTBALL_DATA_API_URL}/competitions/{code}/matches?status=FINISHED",
+                                         headers, code, deadline)
+    recent = {}
+    for match in _finished_matches(data):
+        for team_id in (match['home_id'], match['away_id']):
+            team_matches = recent.setdefault(team_id, [])
+            if len(team_matches) < ENRICHMENT_FORM_MATCHES:
+                team_matches.append(match)
+    # Drużyny bez meczów w sezonie też zapisujemy, żeby nie pytać o nie ponownie tego samego dnia
+    for team_id in set(recent) | set(team_ids):
+        _enrichment_cache.set(f"team:{team_id}", recent.get(team_id, []))
+    return len(set(recent) | set(team_ids))
+
+def _prefetch_head2head(match, headers, deadline=None):
+    data = _football_data_background_get(
+        f"{FOOTBALL_DATA_API_URL}/matches/{match['football_data_id']}/head2head?limit={ENRICHMENT_H2H_MATCHES}",
+        headers, 'head2head', deadline)
+    _enrichment_cache.set(_head2head_key(match['home_team_id'], match['away_team_id']),
+                          _finished_matches(data)[:ENRICHMENT_H2H_MATCHES])
+
+def _prefetch_enrichment(matches, deadline=None):
+    """Hurtowo pobiera brakujące dane o formie i bilansie bezpośrednim dla meczów dnia; zwraca raport.
+
+    Forma: jedno zapytanie na ligę (a nie na drużynę); bilans bezpośredni: jedno zapytanie na mecz.
+    Dane z dzisiaj są pomijane, więc kolejne odświeżenia listy meczów nie pytają upstreamu ponownie.
+    deadline (time.monotonic()) ogranicza także oczekiwanie na limit football-data.org.
+    """
+    started = time.monotonic()
+    fixtures = [match for match in matches
+                if match.get('home_team_id') and match.get('away_team_id') and match.get('league') in COMPETITIONS]
+    report = {'fixtures': len(fixtures), 'leagues_fetched': 0, 'teams': 0, 'head2head': 0, 'errors': []}
+    api_key = os.environ.get('FOOTBALL_DATA_API_KEY')
+    if not api_key or not fixtures:
+        return report
+    headers = {'X-Auth-Token': api_key}
+
+    stale_teams = {}
+    for match in fixtures:
+        for team_id in (match['home_team_id'], match['away_team_id']):
+            if not _enrichment_fresh(f"team:{team_id}"):
+                stale_teams.setdefault(COMPETITIONS[match['league']], set()).add(team_id)
+    steps = [(code, lambda code=code, team_ids=team_ids: _prefetch_team_form(code, team_ids, headers, deadline), 'teams')
+             for code, team_ids in stale_teams.items()]
+    steps += [(f"h2h {match['home_team']} - {match['away_team']}", lambda match=match: _prefetch_head2head(match, headers, deadline), 'head2head')
+              for match in fixtures
+              if match.get('football_data_id') and not _enrichment_fresh(_head2head_key(match['home_team_id'], match['away_team_id']))]
+    for name, step, counter in steps:
+        if deadline is not None and time.monotonic() >= deadline:
+            report['errors'].append(f"{name}: przekroczony limit czasu")
+            break
+        try:
+            result = step()
+        except (RateLimitExceeded, CircuitOpen) as e:
+            # Resztę dociągnie kolejne odświeżenie listy meczów
+            report['errors'].append(f"{name}: {e}")
+            break
+        except Exception as e:
+            report['errors'].append(f"{name}: {e}")
+            continue
+        if counter == 'teams':
+            report['leagues_fetched'] += 1
+            report['teams'] += result
+        else:
+            report['head2head'] += 1
+    report['duration_ms'] = _elapsed_ms(started)
+    return report
+
+def _claim_enrichment_prefetch():
+    """Zwraca (Future pobierania, True) dla nowego pobierania albo (Future trwającego, False)."""
+    global _enrichment_inflight
+    with _enrichment_lock:
+        if _enrichment_inflight is not None:
+            return _enrichment_inflight, False
+        _enrichment_inflight = Future()
+        return _enrichment_inflight, True
+
+def _run_enrichment_prefetch(matches, future, deadline=None):
+    global _enrichment_inflight, _enrichment_report
+    report = None
+    try:
+        report = _prefetch_enrichment(matches, deadline)
+        if report['leagues_fetched'] or report['head2head'] or report['errors']:
+            print(f"Dane o formie drużyn: {report}")
+        _enrichment_report = {**report, 'finished_at': int(time.time())}
+    except Exception as e:
+        print(f"Błąd pobierania danych o formie drużyn: {e}")
+    finally:
+        with _enrichment_lock:
+            _enrichment_inflight = None
+        future.set_result(report)
+    return report
+
+def _prefetch_enrichment_in_background(matches):
+    """Uruchamia _prefetch_enrichment w tle (najwyżej jedno naraz)."""
+    if not ENRICHMENT_ENABLED:
+        return
+    future, claimed = _claim_enrichment_prefetch()
+    if claimed:
+        threading.Thread(target=_run_enrichment_prefetch, args=(matches, future), name='enrichment-prefetch', daemon=True).start()
+
+def _await_enrichment(matches, deadline):
+    """Dla pre-warmu: czeka na trwające pobieranie danych o formie albo wykonuje je sam - najdłużej do deadline."""
+    future, claimed = _claim_enrichment_prefetch()
+    if claimed:
+        return _run_enrichment_prefetch(matches, future, deadline)
+    try:
+        # Pobieranie w tle nie ma terminu - po jego upływie pre-warm rusza z tym, co już jest w cache
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FuturesTimeoutError:
+        print("Pre-warm: pobieranie danych o formie drużyn nie skończyło się w limicie czasu")
+        return None
+
+# Wynik meczu z perspektywy drużyny: wygrana / remis / porażka
+_RESULT_LETTERS = {1: 'W', 0: 'R', -1: 'P'}
+
+def _team_form_lines(team_name, team_id):
+    entry = _enrichment_cache.get(f"team:{team_id}")
+    if entry is None or not entry[0]:
+        return []
+    letters, details = [], []
+    for match in entry[0]:
+        at_home = match['home_id'] == team_id
+        scored, conceded = match['score'] if at_home else reversed(match['score'])
+        letters.append(_RESULT_LETTERS[(scored > conceded) - (scored < conceded)])
+        opponent = match['away'] if at_home else match['home']
+        details.append(f"{_format_match_date(match['date'])[:5]} {'u siebie' if at_home else 'na wyjeździe'} "
+                       f"z {opponent} {scored}:{conceded}")
+    return [f"- **Forma {team_name}** (ostatnie {len(letters)} w lidze, od najnowszego): {' '.join(letters)}",
+            f"  {'; '.join(details)}"]
+
+def _head2head_lines(home_team, home_team_id, away_team, away_team_id):
+    entry = _enrichment_cache.get(_head2head_key(home_team_id, away_team_id))
+    if entry is None or not entry[0]:
+        return []
+    meetings = entry[0]
+    wins = {home_team_id: 0, away_team_id: 0}
+    draws = goals = 0
+    for match in meetings:
+        home_goals, away_goals = match['score']
+        goals += home_goals + away_goals
+        if home_goals == away_goals:
+            draws += 1
+        else:
+            winner = match['home_id'] if home_goals > away_goals else match['away_id']
+            wins[winner] = wins.get(winner, 0) + 1
+    details = '; '.join(f"{_format_match_date(match['date'])} {match['home']} {match['score'][0]}:{match['score'][1]} {match['away']}"
+                        for match in meetings)
+    return [f"- **Bilans bezpośredni** (ostatnie {len(meetings)}): {home_team} {wins[home_team_id]} zw., "
+            f"{draws} rem., {away_team} {wins[away_team_id]} zw.; średnio {goals / len(meetings):.1f} bramki na mecz",
+            f"  {details}"]
+
+def _enrichment_context(match):
+    """Zwięzłe podsumowanie formy i bilansu bezpośredniego do promptu - tylko z cache, bez zapytań do upstreamu."""
+    if not ENRICHMENT_ENABLED:
+        return ''
+    try:
+        home_team_id, away_team_id = int(match.get('home_team_id')), int(match.get('away_team_id'))
+    except (TypeError, ValueError):
+        return ''
+    home_team, away_team = match.get('home_team'), match.get('away_team')
+    lines = (_team_form_lines(home_team, home_team_id) + _team_form_lines(away_team, away_team_id)
+             + _head2head_lines(home_team, home_team_id, away_team, away_team_id))
+    if not lines:
+        return ''
+    return "📋 **AKTUALNE DANE (football-data.org):**\n" + "\n".join(lines)
+
+# Lista meczów: największa strona (?limit=)
+MATCHES_MAX_PAGE = int(os.environ.get('MATCHES_MAX_PAGE', '500'))
+# Odpowiedzi mniejsze niż tyle bajtów nie są kompresowane - zysk byłby mniejszy niż koszt
+MATCHES_COMPRESS_MIN_BYTES = int(os.environ.get('MATCHES_COMPRESS_MIN_BYTES', '1024'))
+MATCHES_GZIP_LEVEL = int(os.environ.get('MATCHES_GZIP_LEVEL', '6'))
+MATCHES_BROTLI_QUALITY = int(os.environ.get('MATCHES_BROTLI_QUALITY', '5'))
+# Pola meczu dostępne w projekcji (?fields=)
+MATCH_FIELDS = ('id', 'league', 'date', 'home_team', 'away_team', 'status', 'source', 'sources',
+                'football_data_id', 'home_team_id', 'away_team_id')
+_KICKOFF_RE = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}')
+_TIME_OF_DAY_RE = re.compile(r'\d{2}:\d{2}')
+
+class _MatchIndex:
+    """Indeks meczów jednego dnia: lista posortowana po starcie (UTC, do wyszukiwania binarnego)
+    i pozycje meczów według ligi i statusu - filtry nie przeglądają całej listy."""
+
+    def __init__(self, matches):
+        keyed = sorted(((_normalize_kickoff(match.get('date')), position, match) for position, match in enumerate(matches)),
+                       key=lambda item: item[:2])
+        self.kickoffs = [kickoff for kickoff, _, _ in keyed]
+        self.matches = [match for _, _, match in keyed]
+        self.by_league, self.by_status = {}, {}
+        for position, match in enumerate(self.matches):
+            self.by_league.setdefault(str(match.get('league', '')).lower(), []).append(position)
+            self.by_status.setdefault(str(match.get('status', '')).upper(), []).append(position)
+
+    def query(self, leagues=None, statuses=None, kickoff_from=None, kickoff_to=None):
+        """Mecze spełniające wszystkie filtry, od najwcześniejszego; granice czasu włącznie."""
+        low = bisect_left(self.kickoffs, kickoff_from) if kickoff_from else 0
+        high = bisect_right(self.kickoffs, kickoff_to) if kickoff_to else len(self.kickoffs)
+        selected = None
+        for values, index in ((leagues, self.by_league), (statuses, self.by_status)):
+            if values:
+                positions = {position for value in values for position in index.get(value, ())}
+                selected = positions if selected is None else selected & positions
+        if selected is None:
+            return self.matches[low:high]
+        return [self.matches[position] for position in sorted(selected) if low <= position < high]
+
+# Indeksy ostatnio serwowanych list meczów - budowane raz na wersję listy w cache
+_match_indexes = OrderedDict()
+_match_indexes_lock = threading.Lock()
+
+def _match_index(day_str, payload, stored_at):
+    key = (_matches_cache_key(day_str), stored_at)
+    with _match_indexes_lock:
+        index = _match_indexes.get(key)
+    if index is None:
+        with _timed('index-matches'):
+            index = _MatchIndex(payload['matches'])
+        with _match_indexes_lock:
+            _match_indexes[key] = index
+            while len(_match_indexes) > 2 * MATCHES_MAX_DAYS:
+                _match_indexes.popitem(last=False)
+    return index
+
+def _split_param(value):
+    return [item.strip() for item in value.split(',') if item.strip()] if value else None
+
+def _parse_kickoff_bound(value, name):
+    """Granica okna startu: 'GG:MM' (UTC, dla każdego dnia zakresu) albo data i czas ISO 8601."""
+    if not value:
+        return None
+    # '+' ze strefy czasowej w niezakodowanym query string przychodzi jako spacja
+    value = value.strip().replace(' ', '+')
+    if _TIME_OF_DAY_RE.fullmatch(value):
+        kickoff, layout = value, '%H:%M'
+    else:
+        kickoff, layout = _normalize_kickoff(value), '%Y-%m-%dT%H:%M'
+    # Wyrażenia sprawdzają format, a strptime - zakresy godzin i minut (np. 25:99)
+    if layout == '%H:%M' or _KICKOFF_RE.fullmatch(kickoff):
+        try:
+            datetime.strptime(kickoff, layout)
+            return kickoff
+        except ValueError:
+            pass
+    raise ValueError(f"Nieprawidłowa wartość {name} (oczekiwane GG:MM albo data i czas ISO 8601).")
+
+def _parse_int_param(args, name, default, maximum=None):
+    value = args.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+    if number < 0 or (maximum is not None and number > maximum):
+        raise ValueError(f"Nieprawidłowa wartość {name} (liczba od 0{f' do {maximum}' if maximum is not None else ''}).")
+    return number
+
+def _parse_matches_query(args):
+    """Parametry /api/get-matches -> filtry; ValueError z komunikatem dla nieprawidłowych wartości.
+
+    league, status, fields - listy rozdzielone przecinkami; date_from / date_to - RRRR-MM-DD;
+    kickoff_from / kickoff_to - okno startu; limit / offset - paginacja; include_status=1 - koperta ze statusem lig.
+    """
+    try:
+        date_from = date.fromisoformat(args['date_from']) if args.get('date_from') else date.today()
+        date_to = date.fromisoformat(args['date_to']) if args.get('date_to') else date_from
+    except ValueError:
+        raise ValueError("Nieprawidłowa data (oczekiwany format RRRR-MM-DD).")
+    if not 0 <= (date_to - date_from).days < MATCHES_MAX_DAYS:
+        raise ValueError(f"Zakres dat musi obejmować od 1 do {MATCHES_MAX_DAYS} dni.")
+    fields = _split_param(args.get('fields'))
+    unknown = [field for field in fields or () if field not in MATCH_FIELDS]
+    if unknown:
+        raise ValueError(f"Nieznane pola: {', '.join(unknown)}. Dostępne: {', '.join(MATCH_FIELDS)}.")
+    return {
+        'days': [(date_from + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range((date_to - date_from).days + 1)],
+        'leagues': [league.lower() for league in _split_param(args.get('league')) or ()],
+        'statuses': [status.upper() for status in _split_param(args.get('status')) or ()],
+        'kickoff_from': _parse_kickoff_bound(args.get('kickoff_from'), 'kickoff_from'),
+        'kickoff_to': _parse_kickoff_bound(args.get('kickoff_to'), 'kickoff_to'),
+        'fields': fields,
+        'limit': _parse_int_param(args, 'limit', None, MATCHES_MAX_PAGE),
+        'offset': _parse_int_param(args, 'offset', 0),
+        'include_status': args.get('include_status') in ('1', 'true'),
+    }
+
+def _query_matches(query):
+    """Wykonuje zapytanie o mecze na indeksach kolejnych dni; zwraca (dane odpowiedzi, nagłówki, stored_at)."""
+    # Brakujące dni pobierane są jednym zapytaniem na źródło dla całego zakresu
+    loaded = _get_matches_range_cached(query['days'])
+    selected, days, stored_at, cache_states = [], {}, 0.0, set()
+    for day_str, (payload, day_stored_at, cache_state) in zip(query['days'], loaded):
+        stored_at = max(stored_at, day_stored_at)
+        cache_states.add(cache_state)
+        days[day_str] = payload
+        # 'GG:MM' oznacza tę samą godzinę każdego dnia zakresu
+        bounds = [f"{day_str}T{bound}" if bound and len(bound) == 5 else bound
+                  for bound in (query['kickoff_from'], query['kickoff_to'])]
+        with _timed('filter-matches'):
+            selected.extend(_match_index(day_str, payload, stored_at=day_stored_at).query(
+                query['leagues'], query['statuses'], *bounds))
+
+    total = len(selected)
+    end = None if query['limit'] is None else query['offset'] + query['limit']
+    page = selected[query['offset']:end]
+    if query['fields']:
+        page = [{field: match[field] for field in query['fields'] if field in match} for match in page]
+
+    headers = {
+        'Cache-Control': 'no-cache',
+        'X-Cache': next(state for state in ('MISS', 'STALE', 'HIT') if state in cache_states),
+        'X-Total-Count': str(total),
+    }
+    # Lista niepełna (błąd, limit, timeout albo otwarty bezpiecznik którejś ligi) - sygnał także bez include_status
+    failed = {}
+    for payload in days.values():
+        for league, status in payload['leagues'].items():
+            if status.get('status') != 'ok':
+                failed.setdefault(league, status.get('status', 'error'))
+    if failed:
+        headers['X-Degraded'] = 'partial'
+        headers['X-Degraded-Leagues'] = ', '.join(f"{league}={status}" for league, status in failed.items())
+
+    if not query['include_status']:
+        return page, headers, stored_at
+    first_day = days[query['days'][0]]
+    data = {'matches': page, 'total': total, 'offset': query['offset'], 'limit': query['limit'],
+            'leagues': first_day['leagues'], 'sources': first_day['sources']}
+    if len(days) > 1:
+        data['days'] = {day_str: {'leagues': payload['leagues'], 'sources': payload['sources']} for day_str, payload in days.items()}
+    return data, headers, stored_at
+
+def _dumps_json(data):
+    """JSON w UTF-8 bez zbędnych spacji - przez orjson, jeśli jest zainstalowany."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _negotiate_encoding(accept_encoding, size):
+    """Wybiera kompresję z Accept-Encoding (br przed gzip); None - bez kompresji."""
+    if size < MATCHES_COMPRESS_MIN_BYTES or not accept_encoding:
+        return None
+    accepted = parse_accept_header(accept_encoding)
+    for encoding in (('br',) if brotli is not None else ()) + ('gzip',):
+        if accepted.quality(encoding) > 0:
+            return encoding
+    return None
+
+def _encode_json_response(data, accept_encoding):
+    """Serializuje i ewentualnie kompresuje dane; zwraca (ciało, kodowanie albo None, etag, statystyki).
+
+    ETag liczony jest z nieskompresowanego JSON-a - przy kompresji jest słaby, jak robią to proxy.
+    """
+    started = time.perf_counter()
+    with _timed('serialize'):
+        raw = _dumps_json(data)
+    encode_ms = (time.perf_counter() - started) * 1000
+    encoding = _negotiate_encoding(accept_encoding, len(raw))
+    body, compress_ms = raw, 0.0
+    if encoding:
+        started = time.perf_counter()
+        with _timed('compress'):
+            if encoding == 'br':
+                body = brotli.compress(raw, quality=MATCHES_BROTLI_QUALITY)
+            else:
+                body = gzip.compress(raw, compresslevel=MATCHES_GZIP_LEVEL)
+        compress_ms = (time.perf_counter() - started) * 1000
+    stats = {'encode_ms': encode_ms, 'compress_ms': compress_ms, 'raw_bytes': len(raw), 'sent_bytes': len(body),
+             'encoding': encoding or 'identity', 'encoder': 'orjson' if orjson is not None else 'json'}
+    return body, encoding, hashlib.sha1(raw).hexdigest(), stats
+
+def _size_timing(stats):
+    """Wpis Server-Timing z rozmiarem odpowiedzi (przed i po kompresji) i użytym enkoderem."""
+    return (f'size;desc="raw={stats["raw_bytes"]}B sent={stats["sent_bytes"]}B '
+            f'{stats["encoding"]} {stats["encoder"]}"')
+
+@app.route('/api/get-matches', methods=['GET'])
+def get_matches():
+    try:
+        query = _parse_matches_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    data, headers, stored_at = _query_matches(query)
+
+    body, encoding, etag, stats = _encode_json_response(data, request.headers.get('Accept-Encoding'))
+    _server_timing_note(_size_timing(stats))
+    response = Response(body, mimetype='application/json', headers=headers)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag, weak=bool(encoding))
+    response.last_modified = datetime.fromtimestamp(int(stored_at), timezone.utc)
+    return response.make_conditional(request)
+
+PERPLEXITY_API_URL = os.environ.get('PERPLEXITY_API_URL', "https://api.perplexity.ai/chat/completions")
+# Limit czasu odczytu odpowiedzi Perplexity (w sekundach)
+PERPLEXITY_TIMEOUT = float(os.environ.get('PERPLEXITY_TIMEOUT', '55'))
+_perplexity_client = _UpstreamClient('perplexity', read_timeout=PERPLEXITY_TIMEOUT)
+
+def _perplexity_request(prompt, api_key, stream=False):
+    """Zwraca (payload, headers) zapytania do API Perplexity."""
     # Używamy modelu 'sonar-medium-online', który ma dostęp do internetu i jest odpowiedni do analiz.
     payload = {
         "model": "sonar",
         # Cały prompt jest teraz kontrolowany przez frontend.
         "messages": [{"role": "user", "content": prompt}]
     }
+    if stream:
+        payload["stream"] = True
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    data = response.json()
+    return payload, headers
+
+def _call_perplexity_api(prompt, api_key):
+    """Komunikuje się z API Perplexity."""
+    payload, headers = _perplexity_request(prompt, api_key)
+    with _breaker(f"perplexity/{payload['model']}").guard():
+        response = _perplexity_client.post(PERPLEXITY_API_URL, json=payload, headers=headers)
+        response.raise_for_status()
+    with _timed('json-parse'):
+        data = response.json()
+    return _perplexity_response_data(data)
+
+def _perplexity_response_data(data):
+    """Wyciąga tekst z odpowiedzi Perplexity."""
     text_response = data.get('choices', [{}])[0].get('message', {}).get('content', '')
     if not text_response:
         raise Exception("API Perplexity zwróciło pustą odpowiedź.")
     # Ujednolicamy format odpowiedzi, aby pasował do tego z Gemini
     return {"candidates": [{"content": {"parts": [{"text": text_response}]}}]}
 
+# Cache wyników analiz - ten sam prompt dla tego samego modelu daje tę samą analizę
+ANALYSIS_CACHE_TTL = int(os.environ.get('ANALYSIS_CACHE_TTL', '3600'))
+# Odpowiedzi z groundingiem zawierają bieżące informacje, więc starzeją się szybciej
+ANALYSIS_CACHE_TTL_GROUNDED = int(os.environ.get('ANALYSIS_CACHE_TTL_GROUNDED', '600'))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', '256'))
+_analysis_cache = _TTLCache(ANALYSIS_CACHE_TTL, _open_store('analysis_cache'), max_entries=ANALYSIS_CACHE_MAX_ENTRIES)
+_analysis_flight = _SingleFlight()
+# Analizy przygotowane z wyprzedzeniem przez pre-warm - ważne dłużej niż zwykły cache, do rozpoczęcia meczów
+PREWARM_TTL = int(os.environ.get('PREWARM_TTL', str(12 * 3600)))
+_prewarmed_analyses = _TTLCache(PREWARM_TTL, _open_store('prewarmed_analyses'), max_entries=ANALYSIS_CACHE_MAX_ENTRIES)
+
+def _prewarmed_analysis(key):
+    """Świeża analiza z pre-warmu dla klucza cache analiz albo None."""
+    entry = _prewarmed_analyses.get(key)
+    return entry if entry is not None and _prewarmed_analyses.is_fresh(entry[1]) else None
+
+def _analysis_cache_key(model_choice, prompt, use_grounding):
+    raw = json.dumps([model_choice, prompt, bool(use_grounding)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def _lookup_analysis(key, use_grounding):
+    """Gotowa analiza dla klucza: świeży wpis cache analiz, potem wynik pre-warmu.
+
+    Zwraca ((odpowiedź, info o cache), None) albo (None, przeterminowany wpis lub None) - ten wpis
+    podaje się do _stale_analysis, gdy upstream jest wyłączony bezpiecznikiem.
+    """
+    ttl = ANALYSIS_CACHE_TTL_GROUNDED if use_grounding else ANALYSIS_CACHE_TTL
+    entry = _analysis_cache.get(key)
+    if entry is not None and _analysis_cache.is_fresh(entry[1], ttl):
+        return (entry[0], {'status': 'hit', 'age_s': int(time.time() - entry[1])}), None
+    prewarmed = _prewarmed_analyses.get(key)
+    if prewarmed is not None and _prewarmed_analyses.is_fresh(prewarmed[1]):
+        return (prewarmed[0], {'status': 'prewarmed', 'age_s': int(time.time() - prewarmed[1])}), None
+    return None, entry or prewarmed
+
+def _stale_analysis(stale_entry):
+    """Przeterminowana analiza zamiast błędu przy otwartym bezpieczniku - (odpowiedź, info) albo None."""
+    if stale_entry is None:
+        return None
+    return stale_entry[0], {'status': 'stale', 'age_s': int(time.time() - stale_entry[1]), 'degraded': True}
+
+def _analysis_text(response_data):
+    return response_data['candidates'][0]['content']['parts'][0]['text']
+
+def _cached_analysis(model_choice, prompt, use_grounding, call):
+    """Zwraca (odpowiedź, info o cache) - równoległe identyczne zapytania czekają na jedno wywołanie API."""
+    key = _analysis_cache_key(model_choice, prompt, use_grounding)
+    cached, stale_entry = _lookup_analysis(key, use_grounding)
+    if cached is not None:
+        return cached
+
+    def _compute():
+        response_data = call()
+        _analysis_cache.set(key, response_data)
+        return response_data
+
+    try:
+        response_data, shared = _analysis_flight.do(key, _compute)
+    except CircuitOpen:
+        # Upstream wyłączony bezpiecznikiem - przeterminowana analiza jest lepsza niż błąd
+        stale = _stale_analysis(stale_entry)
+        if stale is None:
+            raise
+        return stale
+    return response_data, {'status': 'coalesced' if shared else 'miss', 'age_s': 0}
+
 def should_use_grounding(prompt):
     """Sprawdza czy prompt wymaga aktualnych danych"""
     keywords = ['dzisiaj', 'obecnie', 'najnowsze', 'aktualne', 'ostatnie mecze', 'dzisiejsze', 'teraz']
     return any(keyword in prompt.lower() for keyword in keywords)
 
-def _call_gemini_api(prompt, api_key, use_grounding=False):
-    """Komunikuje się z API Gemini z opcjonalnym groundingiem."""
-    try:
-        genai.configure(api_key=api_key)
-        
-        # Użyj grounding jeśli włączony przez użytkownika
-        if use_grounding:
-            print("Używam grounding search (włączony przez użytkownika)...")
-            try:
-                # Próbuj nową składnię (v0.3.0+)
-                tools = [{"google_search_retrieval": {}}]
-                model = genai.GenerativeModel('gemini-1.5-flash', tools=tools)
-            except Exception as e:
-                print(f"Błąd z nową składnią grounding: {e}")
-                try:
-                    # Próbuj starszą składnię
-                    model = genai.GenerativeModel(
-                        'gemini-2.0-flash',
-                        tools=[genai.Tool.from_google_search_retrieval(genai.GoogleSearchRetrieval())]
-                    )
-                except Exception as e2:
-                    print(f"Błąd ze starszą składnią grounding: {e2}")
-                    # Fallback - rzuć błąd z sugestią aktualizacji
-                    raise Exception("Grounding search nie jest dostępny. Zaktualizuj bibliotekę google-generativeai do wersji >=0.3.0 lub użyj Perplexity, które ma wbudowane wyszukiwanie internetowe.")
-            
-            # Optymalizacja promptu dla grounding
-            optimized_prompt = f"""
-            {prompt}
-            
-            INSTRUKCJE WYSZUKIWANIA:
-            - Szukaj tylko najważniejszych, aktualnych informacji
-            - Ogranicz się do ostatnich 24 godzin
-            - Skup się na konkretnych faktach, nie opiniach
-            - Bądź zwięzły w odpowiedzi
-            """
-        else:
-            print("Używam standardowego modelu bez grounding...")
-            model = genai.GenerativeModel('gemini-2.0-flash')
-            optimized_prompt = prompt
-
-        # Konfiguracja generowania z timeoutem
-        generation_config = genai.GenerationConfig(
-            max_output_tokens=2000,  # Ograniczenie długości
-            temperature=0.1,         # Mniej kreatywności = szybsza odpowiedź
-        )
+def _stream_perplexity_api(prompt, api_key):
+    """Strumieniuje odpowiedź Perplexity (stream: true) - zwraca kolejne fragmenty tekstu."""
+    payload, headers = _perplexity_request(prompt, api_key, stream=True)
+    with _breaker(f"perplexity/{payload['model']}").guard(), \
+            _perplexity_client.post(PERPLEXITY_API_URL, json=payload, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        for raw_line in response.iter_lines():
+            line = raw_line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            data = line[len('data:'):].strip()
+            if data == '[DONE]':
+                break
+            text = json.loads(data).get('choices', [{}])[0].get('delta', {}).get('content')
+            if text:
+                yield text
+
+# Adres API Gemini, np. http://127.0.0.1:8080 dla lokalnej atrapy (puste = domyślny endpoint Google)
+GEMINI_API_ENDPOINT = os.environ.get('GEMINI_API_ENDPOINT', '')
+# Rozmiar cache skonfigurowanych modeli Gemini (klucz API x model x narzędzia)
+GEMINI_MODEL_CACHE_SIZE = int(os.environ.get('GEMINI_MODEL_CACHE_SIZE', '32'))
+# Warianty składni grounding: nazwa -> (model, fabryka narzędzi), w kolejności prób
+_GEMINI_GROUNDING_VARIANTS = OrderedDict([
+    # Nowa składnia (v0.3.0+)
+    ('search_retrieval_dict', ('gemini-1.5-flash', lambda: [{"google_search_retrieval": {}}])),
+    # Starsza składnia
+    ('search_retrieval_tool', ('gemini-2.0-flash', lambda: [genai.Tool.from_google_search_retrieval(genai.GoogleSearchRetrieval())])),
+])
+_gemini_models = OrderedDict()
+_gemini_models_lock = threading.Lock()
+# Wykryty wariant grounding: None - jeszcze nie sprawdzano, '' - żaden nie działa
+_gemini_grounding_variant = None
+
+def _detect_grounding_variant():
+    """Raz na proces sprawdza, którą składnię grounding obsługuje zainstalowana biblioteka."""
+    global _gemini_grounding_variant
+    if _gemini_grounding_variant is not None:
+        return _gemini_grounding_variant
+    _load_google_ai()
+    detected = ''
+    for variant, (model_name, make_tools) in _GEMINI_GROUNDING_VARIANTS.items():
+        try:
+            genai.GenerativeModel(model_name, tools=make_tools())
+            detected = variant
+            break
+        except Exception as e:
+            print(f"Składnia grounding '{variant}' niedostępna: {e}")
+    print(f"Wykryta składnia grounding: {detected or 'brak'}")
+    _gemini_grounding_variant = detected
+    return detected
+
+def _get_gemini_model(api_key, model_name, grounding_variant='', use_async=False):
+    """Zwraca model Gemini z własnym klientem dla danego klucza API (LRU, bez globalnego genai.configure).
+
+    use_async=True daje model z klientem asynchronicznym (generate_content_async) dla trybu ASGI.
+    """
+    _load_google_ai()
+    key = (hashlib.sha256(api_key.encode('utf-8')).hexdigest(), model_name, grounding_variant, use_async)
+    with _gemini_models_lock:
+        model = _gemini_models.get(key)
+        if model is not None:
+            _gemini_models.move_to_end(key)
+            return model
+
+    if grounding_variant:
+        model = genai.GenerativeModel(model_name, tools=_GEMINI_GROUNDING_VARIANTS[grounding_variant][1]())
+    else:
+        model = genai.GenerativeModel(model_name)
+    # Każdy klucz ma osobnego klienta - genai.configure jest globalne dla procesu
+    # i przy równoległych zapytaniach użytkownicy mogliby użyć cudzego klucza
+    client_options = {"api_key": api_key}
+    if GEMINI_API_ENDPOINT:
+        client_options["api_endpoint"] = GEMINI_API_ENDPOINT
+    # Adres z http:// wymaga transportu REST (gRPC łączy się tylko przez host:port)
+    transport = 'rest' if GEMINI_API_ENDPOINT.startswith('http') else None
+    # _client / _async_client to prywatne atrybuty biblioteki (sprawdzone do 0.8.x, górna granica w requirements.txt)
+    client_attr = '_async_client' if use_async else '_client'
+    if not hasattr(model, client_attr):
+        # Biblioteka bez tego atrybutu - domyślny klient z genai.configure, wspólny dla procesu,
+        # więc poprawny tylko przy jednym kluczu (GEMINI_API_KEY w zmiennych środowiskowych)
+        print(f"GenerativeModel nie ma atrybutu {client_attr} - używam domyślnego klienta genai.configure")
+        genai.configure(api_key=api_key, transport=transport,
+                        client_options={"api_endpoint": GEMINI_API_ENDPOINT} if GEMINI_API_ENDPOINT else None)
+    elif use_async:
+        model._async_client = glm.GenerativeServiceAsyncClient(client_options=client_options)
+    else:
+        model._client = glm.GenerativeServiceClient(client_options=client_options, transport=transport)
+
+    with _gemini_models_lock:
+        model = _gemini_models.setdefault(key, model)
+        _gemini_models.move_to_end(key)
+        while len(_gemini_models) > GEMINI_MODEL_CACHE_SIZE:
+            _gemini_models.popitem(last=False)
+    return model
+
+def _prepare_gemini_request(prompt, api_key, use_grounding, use_async=False):
+    """Zwraca (model, prompt, generation_config) dla zapytania Gemini."""
+    _load_google_ai()
+    # Użyj grounding jeśli włączony przez użytkownika
+    if use_grounding:
+        print("Używam grounding search (włączony przez użytkownika)...")
+        grounding_variant = _detect_grounding_variant()
+        if not grounding_variant:
+            # Fallback - rzuć błąd z sugestią aktualizacji
+            raise Exception("Grounding search nie jest dostępny. Zaktualizuj bibliotekę google-generativeai do wersji >=0.3.0 lub użyj Perplexity, które ma wbudowane wyszukiwanie internetowe.")
+        model = _get_gemini_model(api_key, _GEMINI_GROUNDING_VARIANTS[grounding_variant][0], grounding_variant, use_async)
+
+        # Optymalizacja promptu dla grounding
+        optimized_prompt = f"""
+        {prompt}
         
+        INSTRUKCJE WYSZUKIWANIA:
+        - Szukaj tylko najważniejszych, aktualnych informacji
+        - Ogranicz się do ostatnich 24 godzin
+        - Skup się na konkretnych faktach, nie opiniach
+        - Bądź zwięzły w odpowiedzi
+        """
+    else:
+        print("Używam standardowego modelu bez grounding...")
+        model = _get_gemini_model(api_key, 'gemini-2.0-flash', use_async=use_async)
+        optimized_prompt = prompt
+
+    # Konfiguracja generowania z timeoutem
+    generation_config = genai.GenerationConfig(
+        max_output_tokens=2000,  # Ograniczenie długości
+        temperature=0.1,         # Mniej kreatywności = szybsza odpowiedź
+    )
+    return model, optimized_prompt, generation_config
+
+def _stream_gemini_api(prompt, api_key, use_grounding=False):
+    """Strumieniuje odpowiedź Gemini (generate_content(stream=True)) - zwraca kolejne fragmenty tekstu."""
+    model, optimized_prompt, generation_config = _prepare_gemini_request(prompt, api_key, use_grounding)
+    with _gemini_breaker(model).guard():
         response = model.generate_content(
             optimized_prompt,
             generation_config=generation_config,
-            request_options={"timeout": 45}  # 45 sekund timeout
+            stream=True,
+            request_options={"timeout": 45}
         )
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Fragment bez tekstu (np. same metadane lub blokada) - pomijamy
+                continue
+            if text:
+                yield text
+    if not response.candidates:
+        reason = response.prompt_feedback.block_reason.name if response.prompt_feedback.block_reason else "Nieznany"
+        raise generation_types.BlockedPromptException(f"API nie zwróciło odpowiedzi. Powód blokady: {reason}")
+
+def _gemini_breaker(model):
+    return _breaker(f"gemini/{model.model_name.split('/')[-1]}")
+
+def _gemini_response_data(response):
+    """Sprawdza odpowiedź Gemini i ujednolica jej format."""
+    if not response.candidates:
+        reason = response.prompt_feedback.block_reason.name if response.prompt_feedback.block_reason else "Nieznany"
+        raise generation_types.BlockedPromptException(f"API nie zwróciło odpowiedzi. Powód blokady: {reason}")
+
+    return {"candidates": [{"content": {"parts": [{"text": response.text}]}}]}
 
-        if not response.candidates:
-            reason = response.prompt_feedback.block_reason.name if response.prompt_feedback.block_reason else "Nieznany"
-            raise generation_types.BlockedPromptException(f"API nie zwróciło odpowiedzi. Powód blokady: {reason}")
+def _call_gemini_api(prompt, api_key, use_grounding=False):
+    """Komunikuje się z API Gemini z opcjonalnym groundingiem."""
+    try:
+        model, optimized_prompt, generation_config = _prepare_gemini_request(prompt, api_key, use_grounding)
 
-        return {"candidates": [{"content": {"parts": [{"text": response.text}]}}]}
+        with _gemini_breaker(model).guard():
+            response = model.generate_content(
+                optimized_prompt,
+                generation_config=generation_config,
+                request_options={"timeout": 45}  # 45 sekund timeout
+            )
+
+        return _gemini_response_data(response)
 
     except Exception as e:
         if "timeout" in str(e).lower():
             raise Exception("Zapytanie przekroczyło limit czasu. Spróbuj ponownie lub użyj Perplexity.")
         raise e
 
+ANALYSIS_TYPES = ('quick', 'detailed', 'betting')
+# Maksymalna długość promptu (w znakach) przyjmowanego od klienta - dłuższe odrzucamy, zanim zapłacimy za tokeny
+PROMPT_MAX_CHARS = int(os.environ.get('PROMPT_MAX_CHARS', '12000'))
+
+# Szablony promptów (wcześniej generatePrompt w index.html); {base_info} to dane meczu, {sources} - instrukcje źródeł
+PROMPT_TEMPLATES = {
+    'quick': """Przeanalizuj szybko mecz piłkarski:
+
+{base_info}{sources}
+
+Podaj zwięzłą analizę (max 150 słów) zawierającą:
+- **Przewidywany wynik** z krótkim uzasadnieniem
+- **Kluczowy gracz** każdej drużyny
+- **Główny typ bukmacherski** (1X2)
+
+Odpowiedz w języku polskim, używając markdown.""",
+    'betting': """Jesteś ekspertem bukmacherskim. Przeanalizuj mecz pod kątem typowania:
+
+{base_info}{sources}
+
+## 💰 ANALIZA BUKMACHERSKA
+
+### Główne typy:
+- **1X2** - przewidywany wynik z oceną pewności (1-10)
+- **Over/Under 2.5** - analiza bramek
+- **Obie drużyny strzelą** - prawdopodobieństwo
+
+### Statystyki kluczowe:
+- **Forma strzelecka** obu drużyn
+- **Bilans bezpośredni** ostatnich spotkań
+- **Motywacja** i znaczenie meczu
+
+### Rekomendacje:
+- **Typ główny** z uzasadnieniem
+- **Typy alternatywne** (niższe ryzyko)
+- **Ocena wartości** kursów
+
+Odpowiedz w języku polskim, używając emotikonów i markdown. Skup się na konkretnych typach.""",
+    'detailed': """Jesteś ekspertem analitykiem piłkarskim z 15-letnim doświadczeniem. Przeanalizuj mecz:
+
+{base_info}{sources}
+
+Wykonaj profesjonalną analizę pre-match uwzględniając:
+
+## 📊 ANALIZA DRUŻYN
+- **Forma ostatnich 5 meczów** (wygrane/remisy/porażki)
+- **Statystyki head-to-head** (ostatnie spotkania)
+- **Pozycja w tabeli** i punkty
+- **Bramki strzelone/stracone** (średnia na mecz)
+
+## ⚽ KLUCZOWI GRACZE
+- **Najlepsi strzelcy** obu drużyn
+- **Kontuzje/zawieszenia** kluczowych graczy
+- **Gracze w formie** (ostatnie występy)
+- **Potencjalne debiuty/powroty**
+
+## 🎯 ANALIZA TAKTYCZNA
+- **Preferowane ustawienia** (4-4-2, 4-3-3, etc.)
+- **Styl gry** (pressing, kontra, posiadanie)
+- **Mocne/słabe strony** każdej drużyny
+- **Przewaga gospodarzy** vs forma gości
+
+## 🌟 CZYNNIKI DECYDUJĄCE
+- **Motywacja** (walka o mistrzostwo/spadek)
+- **Warunki pogodowe** (jeśli istotne)
+- **Presja kibiców** i atmosfera
+- **Znaczenie meczu** w kontekście sezonu
+
+## 🔮 PROGNOZA
+- **Przewidywany wynik** z uzasadnieniem
+- **Prawdopodobny przebieg** meczu
+- **Kluczowe momenty** do obserwowania
+- **Alternatywne scenariusze**
+
+## 💰 TYPY BUKMACHERSKIE
+- **Główny typ** (1X2) z oceną wartości
+- **Typy alternatywne** (over/under, obie drużyny strzelą)
+- **Ocena ryzyka** (niskie/średnie/wysokie)
+- **Uzasadnienie** każdego typu
+
+Odpowiedz w języku polskim, używając emotikonów i formatowania markdown. Bądź konkretny i merytoryczny.""",
+}
+
+# Źródła specyficzne dla ligi (instrukcje dla Perplexity)
+LEAGUE_SOURCES = {
+    'Premier League': '- **premierleague.com** - oficjalne statystyki PL\n- **flashscore.pl/anglia** - wyniki i tabele\n- **skysports.com** - analizy i składy',
+    'La Liga': '- **laliga.es** - oficjalne dane La Liga\n- **flashscore.pl/hiszpania** - statystyki\n- **marca.com** - hiszpańskie analizy',
+    'Serie A': '- **legaseriea.it** - oficjalne statystyki\n- **flashscore.pl/wlochy** - wyniki Serie A\n- **gazzetta.it** - włoskie analizy',
+    'Bundesliga': '- **bundesliga.com** - oficjalne dane\n- **flashscore.pl/niemcy** - statystyki\n- **kicker.de** - niemieckie analizy',
+    'Ligue 1': '- **ligue1.fr** - oficjalne statystyki\n- **flashscore.pl/francja** - wyniki\n- **lequipe.fr** - francuskie analizy',
+    'Primeira Liga': '- **ligaportugal.pt** - oficjalne dane\n- **flashscore.pl/portugalia** - statystyki\n- **abola.pt** - portugalskie analizy',
+    '2. Bundesliga': '- **bundesliga.com/de/2bundesliga** - oficjalne dane\n- **flashscore.pl/niemcy** - statystyki\n- **kicker.de** - niemieckie analizy',
+}
+DEFAULT_LEAGUE_SOURCES = '- **flashscore.pl** - statystyki i wyniki'
+
+# Perplexity sam przeszukuje internet - podpowiadamy, gdzie i czego szukać
+PERPLEXITY_SOURCES_INSTRUCTION = """
+
+🔍 **SPRAWDŹ AKTUALNE DANE NA:**
+- **flashscore.pl** - główne statystyki, wyniki, składy, tabele
+- **transfermarkt.pl** - wartości zawodników, transfery, kontuzje
+- **90minut.pl** - polskie analizy i aktualności
+{league_sources}
+
+📊 **KONKRETNE DANE DO SPRAWDZENIA:**
+- **Forma drużyn**: Ostatnie 5 meczów obu zespołów
+- **Head-to-Head**: Statystyki bezpośrednich spotkań
+- **Składy**: Aktualne kontuzje, zawieszenia, prawdopodobne składy
+- **Tabela**: Pozycje, punkty, bilans bramkowy
+- **Strzelcy**: Forma kluczowych zawodników, top scorers
+- **Statystyki domowe/wyjazdowe**: Średnia bramek, procent wygranych
+- **Defensywa**: Clean sheets, stracone bramki
+- **Transfery**: Ostatnie wzmocnienia i ich wpływ na grę
+
+"""
+# Gemini z groundingiem - lista informacji do wyszukania
+GROUNDING_SOURCES_INSTRUCTION = """
+
+🔍 **WYSZUKAJ AKTUALNE INFORMACJE O:**
+- Ostatnich wynikach i formie obu drużyn
+- Statystykach head-to-head między zespołami
+- Aktualnych kontuzjach i zawieszeniach zawodników
+- Pozycjach w tabeli i punktach
+- Formie strzeleckiej kluczowych graczy
+- Ostatnich transferach i zmianach w składach
+
+💡 **UWAGA**: Skup się na najnowszych danych z {year} roku.
+
+"""
+
+def _format_match_date(date_str):
+    """Data meczu w formacie pl-PL (jak toLocaleDateString we frontendzie), np. 23.08.2025."""
+    try:
+        return datetime.fromisoformat(date_str.replace('Z', '+00:00')).strftime('%d.%m.%Y')
+    except (ValueError, TypeError, AttributeError):
+        return str(date_str)
+
+@lru_cache(maxsize=1024)
+def _render_prompt(home_team, away_team, league, match_date, analysis_type, model_choice, use_grounding, year, context=''):
+    base_info = f"**{home_team} vs {away_team}**\n**Liga:** {league}\n**Data:** {_format_match_date(match_date)}"
+    if context:
+        base_info += f"\n\n{context}"
+    if model_choice == 'perplexity':
+        sources = PERPLEXITY_SOURCES_INSTRUCTION.format(league_sources=LEAGUE_SOURCES.get(league, DEFAULT_LEAGUE_SOURCES))
+    elif use_grounding:
+        sources = GROUNDING_SOURCES_INSTRUCTION.format(year=year)
+    else:
+        sources = ''
+    return PROMPT_TEMPLATES[analysis_type].format(base_info=base_info, sources=sources)
+
+def _build_prompt(match, analysis_type, model_choice='perplexity', use_grounding=False):
+    """Prompt analizy meczu z szablonu - dla tego samego meczu, typu i modelu zawsze ten sam (stabilny klucz cache)."""
+    context = _enrichment_context(match)
+    _metrics.inc('prompt_enrichment_total', enriched='yes' if context else 'no')
+    return _render_prompt(match.get('home_team'), match.get('away_team'), match.get('league'), match.get('date'),
+                          analysis_type, model_choice, bool(use_grounding), date.today().year, context)
+
+def _find_match(match_id):
+    """Szuka meczu o danym id w dzisiejszej liście z cache (bez pobierania z upstreamu)."""
+    entry = _matches_cache.get(_matches_cache_key(date.today().strftime('%Y-%m-%d')))
+    if entry is None:
+        return None
+    return next((match for match in entry[0]['matches'] if match.get('id') == match_id), None)
+
+# Pola meczu przesyłane przez klienta, z których budowany jest prompt
+_MATCH_TEXT_FIELDS = ('home_team', 'away_team', 'league', 'date')
+
+def _clean_match(match):
+    """Dane meczu od klienta z polami tekstowymi jako str (liczby są zamieniane na tekst).
+
+    Zwraca None, jeśli któreś pole ma inny typ - do szablonów z lru_cache trafiają tylko wartości hashowalne.
+    """
+    if not isinstance(match, dict):
+        return None
+    cleaned = {}
+    for field in _MATCH_TEXT_FIELDS:
+        value = match.get(field)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return None
+        cleaned[field] = str(value)
+    for field in ('home_team_id', 'away_team_id'):
+        value = match.get(field)
+        if isinstance(value, int) and not isinstance(value, bool):
+            cleaned[field] = value
+        elif isinstance(value, str) and value.isdigit():
+            cleaned[field] = int(value)
+    return cleaned
+
+def _analysis_prompt(body, model_choice, use_grounding):
+    """Prompt z szablonu dla meczu (matchId albo match + analysisType) lub gotowy 'prompt' jako fallback.
+
+    Zwraca (prompt, None) albo (None, (błąd, status)).
+    """
+    prompt = body.get('prompt')
+    if body.get('matchId') or isinstance(body.get('match'), dict):
+        analysis_type = body.get('analysisType', 'detailed')
+        if analysis_type not in ANALYSIS_TYPES:
+            return None, (f"Nieprawidłowy typ analizy. Dostępne opcje: {', '.join(ANALYSIS_TYPES)}.", 400)
+        # Lista meczów mogła zostać odświeżona - wtedy wystarczą dane meczu przesłane przez klienta
+        match = _find_match(body['matchId']) if isinstance(body.get('matchId'), str) else None
+        if match is None and body.get('match') is not None:
+            match = _clean_match(body['match'])
+            if match is None:
+                return None, ("Nieprawidłowe dane meczu (pola home_team, away_team, league i date muszą być tekstem).", 400)
+        if match and match.get('home_team') and match.get('away_team'):
+            prompt = _build_prompt(match, analysis_type, model_choice, use_grounding)
+        elif not prompt:
+            return None, ("Nie znaleziono meczu. Odśwież listę meczów i spróbuj ponownie.", 404)
+    if not isinstance(prompt, str):
+        return None, ("Nieprawidłowy prompt.", 400)
+    if len(prompt) > PROMPT_MAX_CHARS:
+        return None, (f"Prompt jest zbyt długi ({len(prompt)} znaków, maksymalnie {PROMPT_MAX_CHARS}).", 413)
+    return prompt, None
+
+def _resolve_api_key(model_choice, body):
+    """Zwraca klucz API: najpierw ze zmiennych środowiskowych Vercel, potem z frontendu."""
+    env_name = 'GEMINI_API_KEY' if model_choice == 'gemini' else 'PERPLEXITY_API_KEY'
+    api_key = os.environ.get(env_name)
+    print(f"Backend: {env_name} z env: {'[UKRYTO]' if api_key else 'Brak'}")
+    if not api_key:
+        # Jeśli klucz nie jest ustawiony w zmiennych środowiskowych, pobierz go z frontendu
+        api_key = body.get('geminiApiKey' if model_choice == 'gemini' else 'perplexityApiKey')
+        print(f"Backend: {env_name} z frontendu: {'[UKRYTO]' if api_key else 'Brak'}")
+    return api_key
+
+def _validate_analysis_request(body):
+    """Sprawdza zapytanie o analizę; zwraca (prompt, model, klucz API, grounding, None) albo (..., (błąd, status))."""
+    if not body or not isinstance(body, dict):
+        return None, None, None, False, ('Brak danych w zapytaniu.', 400)
+
+    model_choice = body.get('model')
+    has_match = body.get('matchId') or isinstance(body.get('match'), dict)
+    if not model_choice or not (has_match or body.get('prompt')):
+        return None, None, None, False, ("Brakujące dane w zapytaniu (wymagane: model oraz matchId i analysisType albo prompt).", 400)
+    api_key, use_grounding, error = _resolve_provider(model_choice, body)
+    if error:
+        return None, None, None, False, error
+    prompt, error = _analysis_prompt(body, model_choice, use_grounding)
+    if error:
+        return None, None, None, False, error
+    return prompt, model_choice, api_key, use_grounding, None
+
+def _resolve_provider(model_choice, body):
+    """Sprawdza model i klucz API; zwraca (klucz API, grounding, None) albo (None, False, (błąd, status))."""
+    if model_choice not in ('gemini', 'perplexity'):
+        return None, False, ("Nieprawidłowy model. Dostępne opcje: 'gemini', 'perplexity'.", 400)
+
+    api_key = _resolve_api_key(model_choice, body)
+    if model_choice == 'gemini':
+        if not api_key:
+            return None, False, ("Brak klucza API dla Gemini. Upewnij się, że został dodany w ustawieniach lub w zmiennych środowiskowych Vercel.", 400)
+        if not GOOGLE_AI_AVAILABLE:
+            return None, False, ("Biblioteki Google AI nie są dostępne. Sprawdź konfigurację serwera.", 503)
+        # Sprawdź czy grounding jest włączony przez użytkownika
+        use_grounding = bool(body.get('useGrounding', False))
+        if use_grounding:
+            print("UWAGA: Grounding search włączony - może to potrwać do 60 sekund")
+        return api_key, use_grounding, None
+    if not api_key:
+        return None, False, ("Brak klucza API dla Perplexity. Upewnij się, że został dodany w ustawieniach lub w zmiennych środowiskowych Vercel.", 400)
+    return api_key, False, None
+
+def _analysis_error(e):
+    """Mapuje wyjątek z wywołania modelu na (komunikat, kod HTTP)."""
+    if isinstance(e, google_exceptions.PermissionDenied):
+        return "Błąd API Gemini: Nieprawidłowy klucz API lub brak uprawnień.", 403
+    if isinstance(e, google_exceptions.NotFound):
+        return f"Błąd API Gemini: Nie znaleziono zasobu (np. modelu). Sprawdź poprawność nazwy. Szczegóły: {e}", 404
+    if isinstance(e, google_exceptions.InvalidArgument):
+        return "Błąd API Gemini: Nieprawidłowy argument, sprawdź poprawność promptu.", 400
+    if isinstance(e, requests.exceptions.Timeout):
+        return "Zapytanie przekroczyło limit czasu. Spróbuj ponownie lub użyj Perplexity dla szybszej odpowiedzi.", 408
+    if isinstance(e, requests.exceptions.ConnectionError):
+        return "Błąd połączenia z API. Sprawdź połączenie internetowe i spróbuj ponownie.", 503
+    if isinstance(e, requests.exceptions.HTTPError):
+        if e.response.status_code in [401, 403]:
+            return "Błąd API Perplexity: Nieprawidłowy klucz API lub brak uprawnień.", 403
+        return f"Błąd API Perplexity: {e.response.status_code} - {e.response.text}", e.response.status_code
+    if isinstance(e, generation_types.BlockedPromptException):
+        return f"Twoje zapytanie zostało zablokowane przez API. {e}", 400
+    if isinstance(e, RateLimitExceeded):
+        return f"Przekroczono limit zapytań. {e}", 429
+    if isinstance(e, CircuitOpen):
+        provider = {'gemini': 'Gemini', 'perplexity': 'Perplexity'}.get(e.upstream, e.upstream)
+        alternative = {'gemini': ' lub użyj Perplexity', 'perplexity': ' lub użyj Gemini'}.get(e.upstream, '')
+        return (f"API {provider} jest chwilowo niedostępne (seria błędów). "
+                f"Spróbuj ponownie za {max(1, round(e.retry_after))} s{alternative}."), 503
+    error_msg = str(e)
+    if "timeout" in error_msg.lower():
+        return "Zapytanie przekroczyło limit czasu. Spróbuj ponownie lub użyj Perplexity dla szybszej odpowiedzi.", 408
+    elif "failed to fetch" in error_msg.lower():
+        return "Błąd połączenia. Sprawdź połączenie internetowe i spróbuj ponownie.", 503
+    print(f"Nieoczekiwany błąd: {error_msg}")
+    return f"Wystąpił nieoczekiwany błąd serwera: {error_msg}", 500
+
+def _llm_labels(model_choice, use_grounding, mode):
+    """Etykiety metryk wywołania modelu: dostawca, konkretny model, grounding i tryb (sync/stream/async)."""
+    if model_choice == 'gemini':
+        variant = _gemini_grounding_variant if use_grounding else ''
+        model = _GEMINI_GROUNDING_VARIANTS[variant][0] if variant else 'gemini-2.0-flash'
+    else:
+        model = 'sonar'
+    return {'provider': model_choice, 'model': model, 'grounding': 'on' if use_grounding else 'off', 'mode': mode}
+
+def _call_model(model_choice, prompt, api_key, use_grounding):
+    started = time.monotonic()
+    with _timed('llm', 'llm_request', **_llm_labels(model_choice, use_grounding, 'sync')):
+        if model_choice == 'gemini':
+            response_data = _call_gemini_api(prompt, api_key, use_grounding)
+        else:
+            response_data = _call_perplexity_api(prompt, api_key)
+    _latency_window(model_choice, use_grounding).record(time.monotonic() - started)
+    return response_data
+
+def _stream_model(model_choice, prompt, api_key, use_grounding):
+    if model_choice == 'gemini':
+        return _stream_gemini_api(prompt, api_key, use_grounding)
+    return _stream_perplexity_api(prompt, api_key)
+
+# Zabezpieczanie (hedging) analiz: gdy główny dostawca nie odpowie w progu, to samo zapytanie idzie do drugiego.
+# Próg to HEDGE_PERCENTILE ostatnich czasów odpowiedzi dostawcy (osobno z groundingiem i bez)
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '0.9'))
+# Stały próg w sekundach zamiast wyuczonego (puste = wyuczony)
+HEDGE_DELAY = os.environ.get('HEDGE_DELAY', '')
+# Próg, dopóki nie ma HEDGE_MIN_SAMPLES pomiarów, i dolne ograniczenie wyuczonego progu (w sekundach)
+HEDGE_DEFAULT_DELAY = float(os.environ.get('HEDGE_DEFAULT_DELAY', '10'))
+HEDGE_MIN_DELAY = float(os.environ.get('HEDGE_MIN_DELAY', '1'))
+HEDGE_MIN_SAMPLES = int(os.environ.get('HEDGE_MIN_SAMPLES', '20'))
+# Liczba ostatnich pomiarów, z których liczone są percentyle
+LATENCY_WINDOW_SIZE = int(os.environ.get('LATENCY_WINDOW_SIZE', '200'))
+_HEDGE_ALTERNATES = {'gemini': 'perplexity', 'perplexity': 'gemini'}
+_hedge_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('HEDGE_MAX_WORKERS', '8')), thread_name_prefix='hedge')
+_metrics.describe('hedge_requests_total', 'counter', 'Zabezpieczone analizy według wyniku (kto odpowiedział pierwszy)')
+
+class _LatencyWindow:
+    """Czasy ostatnich udanych odpowiedzi dostawcy (okno przesuwne) do wyliczania percentyli."""
+
+    def __init__(self, size):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def __len__(self):
+        return len(self._samples)
+
+    def snapshot(self):
+        def ms(p):
+            value = self.percentile(p)
+            return round(value * 1000) if value is not None else None
+        return {'samples': len(self), 'p50_ms': ms(0.5), 'p90_ms': ms(0.9), 'p99_ms': ms(0.99)}
+
+_latency_windows = {}
+_latency_windows_lock = threading.Lock()
+
+def _latency_window(model_choice, use_grounding):
+    key = f"{model_choice}/{'grounding' if use_grounding else 'standard'}"
+    with _latency_windows_lock:
+        window = _latency_windows.get(key)
+        if window is None:
+            window = _latency_windows[key] = _LatencyWindow(LATENCY_WINDOW_SIZE)
+        return window
+
+def _hedge_delay(model_choice, use_grounding):
+    """Po ilu sekundach bez odpowiedzi wysłać zapytanie do drugiego dostawcy."""
+    if HEDGE_DELAY:
+        return float(HEDGE_DELAY)
+    window = _latency_window(model_choice, use_grounding)
+    if len(window) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, window.percentile(HEDGE_PERCENTILE))
+
+def _latency_stats():
+    """Statystyki czasów odpowiedzi dostawców i bieżące progi zabezpieczania (do /api/health)."""
+    with _latency_windows_lock:
+        windows = dict(_latency_windows)
+    stats = {}
+    for key, window in sorted(windows.items()):
+        model_choice, mode = key.split('/')
+        stats[key] = {**window.snapshot(), 'hedge_delay_ms': round(_hedge_delay(model_choice, mode == 'grounding') * 1000)}
+    return stats
+
+def _hedge_alternate(model_choice, body):
+    """Zwraca (drugi model, jego klucz API), gdy zapytanie prosi o zabezpieczenie ("hedge": true) i drugi dostawca jest dostępny."""
+    if not body.get('hedge'):
+        return None
+    alternate_model = _HEDGE_ALTERNATES[model_choice]
+    alternate_key, _, error = _resolve_provider(alternate_model, {**body, 'useGrounding': False})
+    if error:
+        print(f"Zabezpieczanie wyłączone - {alternate_model} niedostępny: {error[0]}")
+        return None
+    return alternate_model, alternate_key
+
+def _analysis_cache_model(model_choice, alternate):
+    """Model w kluczu cache - odpowiedź zabezpieczona może pochodzić od drugiego dostawcy, więc ma osobny wpis."""
+    return f"{model_choice}+{alternate[0]}" if alternate else model_choice
+
+def _call_model_cancellable(model_choice, prompt, api_key, use_grounding, cancelled):
+    """Jak _call_model, ale przez API strumieniowe, więc przegrane wywołanie można przerwać.
+
+    Po ustawieniu cancelled odbiór jest przerywany, a połączenie zamykane; wtedy zwraca None.
+    """
+    started = time.monotonic()
+    parts = []
+    with _timed('llm', 'llm_request', **_llm_labels(model_choice, use_grounding, 'hedge')):
+        stream = _stream_model(model_choice, prompt, api_key, use_grounding)
+        try:
+            for text in stream:
+                if cancelled.is_set():
+                    # Przegrany jest zwykle tym wolnym - bez tego pomiaru próg zabezpieczania zaniżałby się
+                    # z każdym odpaleniem; czas do przerwania to dolne oszacowanie jego czasu odpowiedzi
+                    _latency_window(model_choice, use_grounding).record(time.monotonic() - started)
+                    return None
+                parts.append(text)
+        finally:
+            stream.close()
+        if not parts:
+            raise Exception(f"API {model_choice} zwróciło pustą odpowiedź.")
+    _latency_window(model_choice, use_grounding).record(time.monotonic() - started)
+    return {"candidates": [{"content": {"parts": [{"text": ''.join(parts)}]}}]}
+
+def _call_model_hedged(model_choice, prompt, api_key, use_grounding, alternate=None):
+    """Wywołuje model; z alternate=(model, klucz API) zabezpiecza wywołanie drugim dostawcą.
+
+    Drugie zapytanie jest wysyłane, gdy główny dostawca nie odpowie w progu _hedge_delay
+    albo zwróci błąd. Wygrywa pierwsza poprawna odpowiedź, a przegrane wywołanie jest przerywane.
+    """
+    if alternate is None:
+        return _call_model(model_choice, prompt, api_key, use_grounding)
+    alternate_model, alternate_key = alternate
+    delay = _hedge_delay(model_choice, use_grounding)
+    started = time.monotonic()
+    cancelled = threading.Event()
+    primary = _hedge_executor.submit(_call_model_cancellable, model_choice, prompt, api_key, use_grounding, cancelled)
+    calls = {primary: model_choice}
+    done, _ = wait([primary], timeout=delay)
+    reason = None
+    if not done or primary.exception() is not None:
+        reason = 'error' if done else 'slow'
+        print(f"Zabezpieczanie: {model_choice} {'zwrócił błąd' if done else f'nie odpowiedział w {delay:.1f}s'} - wysyłam zapytanie do {alternate_model}")
+        # Drugi dostawca bez groundingu - Perplexity i tak korzysta z internetu, a chodzi o szybką odpowiedź
+        calls[_hedge_executor.submit(_call_model_cancellable, alternate_model, prompt, alternate_key, False, cancelled)] = alternate_model
+
+    errors, pending = {}, set(calls)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                errors[calls[future]] = future.exception()
+                continue
+            cancelled.set()
+            winner = calls[future]
+            _metrics.inc('hedge_requests_total', primary=model_choice, fired='yes' if reason else 'no', winner=winner)
+            return {**future.result(), 'provider': winner, 'hedge': {
+                'fired': reason is not None, 'reason': reason, 'delay_ms': round(delay * 1000),
+                'winner': winner, 'latency_ms': _elapsed_ms(started)}}
+    _metrics.inc('hedge_requests_total', primary=model_choice, fired='yes' if reason else 'no', winner='none')
+    raise errors.get(model_choice) or errors[alternate_model]
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
-    body = request.get_json()
-    if not body:
+    body = request.get_json(silent=True)
+    prompt, model_choice, api_key, use_grounding, error = _validate_analysis_request(body)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+
+    # "hedge": true - przy wolnej odpowiedzi lub błędzie zapytanie trafia też do drugiego dostawcy
+    alternate = _hedge_alternate(model_choice, body)
+
+    # Tryb asynchroniczny: od razu zwracamy identyfikator zadania, wynik odbiera się z /api/jobs/<id>
+    if body.get('async'):
+        job = _submit_analysis_job(model_choice, prompt, api_key, use_grounding, alternate)
+        return jsonify({**_public_job(job), 'poll_url': f"/api/jobs/{job['job_id']}"}), 202
+
+    try:
+        print(f"Rozpoczynam analizę z modelem: {model_choice}{' (zabezpieczoną)' if alternate else ''}")
+        response_data, cache_info = _cached_analysis(
+            _analysis_cache_model(model_choice, alternate), prompt, use_grounding,
+            lambda: _call_model_hedged(model_choice, prompt, api_key, use_grounding, alternate))
+        print(f"Analiza zakończona pomyślnie (cache: {cache_info['status']})")
+        with _timed('serialize'):
+            response = jsonify({**response_data, 'cache': cache_info})
+        response.headers['X-Cache'] = cache_info['status'].upper()
+        return response
+    except Exception as e:
+        message, status = _analysis_error(e)
+        return jsonify({"error": message}), status
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Analiza strumieniowana jako Server-Sent Events.
+
+    Zdarzenia: 'chunk' ({"text": ...}) dla kolejnych fragmentów, na końcu 'done'
+    z czasem do pierwszego fragmentu i całkowitym czasem albo 'error' ({"error": ...}).
+    """
+    prompt, model_choice, api_key, use_grounding, error = _validate_analysis_request(request.get_json(silent=True))
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+
+    def generate():
+        started = time.monotonic()
+        key = _analysis_cache_key(model_choice, prompt, use_grounding)
+        cached, stale_entry = _lookup_analysis(key, use_grounding)
+
+        def cached_events(response_data, cache_info):
+            yield _sse_event('chunk', {'text': _analysis_text(response_data)})
+            yield _sse_event('done', {'model': model_choice, 'ttft_ms': _elapsed_ms(started), 'total_ms': _elapsed_ms(started),
+                                      'cache': cache_info})
+
+        if cached is not None:
+            yield from cached_events(*cached)
+            return
+
+        print(f"Rozpoczynam analizę strumieniową z modelem: {model_choice}")
+        parts, ttft_ms = [], None
+        call_started = time.monotonic()
+        try:
+            with _timed('llm', 'llm_request', **_llm_labels(model_choice, use_grounding, 'stream')):
+                for text in _stream_model(model_choice, prompt, api_key, use_grounding):
+                    if ttft_ms is None:
+                        ttft_ms = _elapsed_ms(started)
+                    parts.append(text)
+                    yield _sse_event('chunk', {'text': text})
+                if not parts:
+                    raise Exception(f"API {model_choice} zwróciło pustą odpowiedź.")
+        except Exception as e:
+            stale = _stale_analysis(stale_entry) if isinstance(e, CircuitOpen) and not parts else None
+            if stale is not None:
+                yield from cached_events(*stale)
+                return
+            message, status = _analysis_error(e)
+            yield _sse_event('error', {'error': message, 'status': status})
+            return
+
+        _latency_window(model_choice, use_grounding).record(time.monotonic() - call_started)
+        _analysis_cache.set(key, {"candidates": [{"content": {"parts": [{"text": ''.join(parts)}]}}]})
+        print("Analiza strumieniowa zakończona pomyślnie")
+        yield _sse_event('done', {'model': model_choice, 'ttft_ms': ttft_ms, 'total_ms': _elapsed_ms(started),
+                                  'cache': {'status': 'miss', 'age_s': 0}})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Limity dostawców dla analiz wsadowych: równoległe wywołania i zapytania na minutę
+PROVIDER_LIMITS = {
+    'gemini': {
+        'concurrency': int(os.environ.get('GEMINI_MAX_CONCURRENCY', '2')),
+        'rate_per_minute': int(os.environ.get('GEMINI_RATE_PER_MINUTE', '15')),
+    },
+    'perplexity': {
+        'concurrency': int(os.environ.get('PERPLEXITY_MAX_CONCURRENCY', '3')),
+        'rate_per_minute': int(os.environ.get('PERPLEXITY_RATE_PER_MINUTE', '50')),
+    },
+}
+BATCH_MAX_MATCHES = int(os.environ.get('BATCH_MAX_MATCHES', '50'))
+# Maksymalny czas (w sekundach) analizy jednego meczu, wliczając czekanie w kolejce, oraz całej partii
+BATCH_MATCH_TIMEOUT = float(os.environ.get('BATCH_MATCH_TIMEOUT', '90'))
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', '280'))
+_provider_slots = {name: threading.BoundedSemaphore(limits['concurrency']) for name, limits in PROVIDER_LIMITS.items()}
+_provider_buckets = {name: _TokenBucket(limits['rate_per_minute']) for name, limits in PROVIDER_LIMITS.items()}
+_batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('BATCH_MAX_WORKERS', '8')), thread_name_prefix='batch-analysis')
+
+def _call_model_limited(model_choice, prompt, api_key, use_grounding, deadline):
+    """Wywołuje model z zachowaniem limitu równoległości i zapytań na minutę danego dostawcy."""
+    slot = _provider_slots[model_choice]
+    if not slot.acquire(timeout=max(0.0, deadline - time.monotonic())):
+        raise RateLimitExceeded(f"Brak wolnego miejsca w kolejce {model_choice}.")
+    try:
+        if not _provider_buckets[model_choice].acquire(max(0.0, deadline - time.monotonic())):
+            raise RateLimitExceeded(f"Wyczerpany limit zapytań na minutę dla {model_choice}.")
+        return _call_model(model_choice, prompt, api_key, use_grounding)
+    finally:
+        slot.release()
+
+def _match_summary(match):
+    return {key: match.get(key) for key in ('home_team', 'away_team', 'league', 'date')}
+
+def _run_batch_item(index, match, analysis_type, model_choice, api_key, use_grounding):
+    """Analizuje jeden mecz z partii - nigdy nie rzuca wyjątku, błąd trafia do wyniku."""
+    started = time.monotonic()
+    deadline = started + BATCH_MATCH_TIMEOUT
+    result = {'type': 'result', 'index': index, 'match': _match_summary(match), 'provider': model_choice}
+    try:
+        # Błędne dane jednego meczu trafiają do jego wyniku, a nie przerywają całego strumienia
+        prompt = match.get('prompt')
+        if not prompt:
+            cleaned = _clean_match(match)
+            if cleaned is None or not (cleaned.get('home_team') and cleaned.get('away_team')):
+                return {**result, 'status': 'error', 'latency_ms': _elapsed_ms(started),
+                        'error': "Nieprawidłowe dane meczu (wymagane home_team i away_team; home_team, away_team, league i date jako tekst)."}
+            prompt = _build_prompt(cleaned, analysis_type, model_choice, use_grounding)
+        if not isinstance(prompt, str):
+            return {**result, 'status': 'error', 'error': "Nieprawidłowy prompt.", 'latency_ms': _elapsed_ms(started)}
+        if len(prompt) > PROMPT_MAX_CHARS:
+            return {**result, 'status': 'error', 'error': f"Prompt jest zbyt długi (maksymalnie {PROMPT_MAX_CHARS} znaków).",
+                    'latency_ms': _elapsed_ms(started)}
+        response_data, cache_info = _cached_analysis(
+            model_choice, prompt, use_grounding,
+            lambda: _call_model_limited(model_choice, prompt, api_key, use_grounding, deadline))
+        text = _analysis_text(response_data)
+        return {**result, 'status': 'ok', 'text': text, 'cache': cache_info, 'latency_ms': _elapsed_ms(started)}
+    except Exception as e:
+        message, status = _analysis_error(e)
+        outcome = {408: 'timeout', 429: 'rate_limited'}.get(status, 'error')
+        return {**result, 'status': outcome, 'error': message, 'latency_ms': _elapsed_ms(started)}
+
+def _format_stream_record(record, stream_format):
+    if stream_format == 'sse':
+        return _sse_event(record['type'], record)
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analiza wielu meczów naraz.
+
+    Body: {"matches": [mecze lub ich id] albo "today", "analysisType": "quick", "model": ..., "format": "ndjson"|"sse"}.
+    Wyniki są strumieniowane w kolejności ukończenia, a na końcu wysyłane jest podsumowanie.
+    """
+    body = request.get_json(silent=True)
+    if not body or not isinstance(body, dict):
         return jsonify({'error': 'Brak danych w zapytaniu.'}), 400
 
-    # Przywracamy oczekiwanie na gotowy 'prompt' z frontendu.
-    prompt = body.get('prompt')
     model_choice = body.get('model')
+    analysis_type = body.get('analysisType', 'quick')
+    if analysis_type not in ANALYSIS_TYPES:
+        return jsonify({'error': f"Nieprawidłowy typ analizy. Dostępne opcje: {', '.join(ANALYSIS_TYPES)}."}), 400
+    api_key, use_grounding, error = _resolve_provider(model_choice, body)
+    if error:
+        return jsonify({'error': error[0]}), error[1]
+
+    matches = body.get('matches', 'today')
+    if matches == 'today':
+        matches = _get_matches_cached(date.today().strftime('%Y-%m-%d'))[0]['matches']
+    elif isinstance(matches, list):
+        # Mecze można podać samymi identyfikatorami z /api/get-matches
+        matches = [_find_match(match) if isinstance(match, str) else match for match in matches]
+        if not all(isinstance(match, dict) for match in matches):
+            return jsonify({'error': 'Nie znaleziono części meczów. Odśwież listę meczów i spróbuj ponownie.'}), 404
+    if not isinstance(matches, list) or not matches:
+        return jsonify({'error': 'Brak meczów do analizy.'}), 400
+    if len(matches) > BATCH_MAX_MATCHES:
+        return jsonify({'error': f"Zbyt wiele meczów w jednym zapytaniu (maksymalnie {BATCH_MAX_MATCHES})."}), 400
+
+    stream_format = 'sse' if body.get('format') == 'sse' else 'ndjson'
+    print(f"Rozpoczynam analizę wsadową {len(matches)} meczów z modelem: {model_choice}")
+
+    def generate():
+        started = time.monotonic()
+        futures = {
+            _batch_executor.submit(_run_batch_item, index, match, analysis_type, model_choice, api_key, use_grounding): index
+            for index, match in enumerate(matches)
+        }
+        pending, counts = set(futures), {}
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, BATCH_TIMEOUT - (time.monotonic() - started)),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                # Przekroczony czas całej partii - pozostałe mecze raportujemy jako timeout
+                for future in pending:
+                    future.cancel()
+                    index = futures[future]
+                    record = {'type': 'result', 'index': index, 'match': _match_summary(matches[index]),
+                              'provider': model_choice, 'status': 'timeout', 'latency_ms': _elapsed_ms(started)}
+                    counts['timeout'] = counts.get('timeout', 0) + 1
+                    yield _format_stream_record(record, stream_format)
+                break
+            for future in done:
+                record = future.result()
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+                yield _format_stream_record(record, stream_format)
+
+        print(f"Analiza wsadowa zakończona: {counts}")
+        yield _format_stream_record({'type': 'summary', 'total': len(matches), 'statuses': counts,
+                                     'total_ms': _elapsed_ms(started)}, stream_format)
 
-    if not prompt or not model_choice:
-        return jsonify({"error": "Brakujące dane w zapytaniu (wymagane: prompt, model)."}), 400
+    mimetype = 'text/event-stream' if stream_format == 'sse' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
+# Pre-warm dnia meczowego: szybkie analizy generowane przed meczami (Vercel Cron albo python prewarm.py),
+# żeby kliknięcia w godzinie przed meczami trafiały w gotowe wyniki zamiast w najwolniejsze modele
+PREWARM_MODELS = [name.strip() for name in os.environ.get('PREWARM_MODELS', 'gemini').split(',') if name.strip()]
+PREWARM_ANALYSIS_TYPE = 'quick'
+PREWARM_CONCURRENCY = int(os.environ.get('PREWARM_CONCURRENCY', '4'))
+# Budżet wydatków: maksymalna liczba wywołań modeli w jednym uruchomieniu (najbliższe mecze mają pierwszeństwo)
+PREWARM_MAX_CALLS = int(os.environ.get('PREWARM_MAX_CALLS', '40'))
+# Łączny limit czasu uruchomienia (w sekundach) - mieści się w maksymalnym czasie funkcji Vercel
+PREWARM_TIMEOUT = float(os.environ.get('PREWARM_TIMEOUT', '250'))
+# Część tego czasu, przez którą pre-warm czeka na dane o formie drużyn (pobierane z limitem i rezerwą tokenów)
+PREWARM_ENRICHMENT_TIMEOUT = float(os.environ.get('PREWARM_ENRICHMENT_TIMEOUT', '60'))
+# Statusy meczów, które jeszcze się nie zaczęły
+_PREWARM_STATUSES = ('SCHEDULED', 'TIMED')
+_prewarm_lock = threading.Lock()
+_prewarm_report = None
+_metrics.describe('prewarm_analyses_total', 'counter', 'Analizy pre-warmu według wyniku (generated / unchanged / failed / skipped)')
+
+def _prewarm_candidates(matches):
+    """Mecze, które jeszcze się nie zaczęły, od najbliższego."""
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M')
+    upcoming = [match for match in matches
+                if match.get('status') in _PREWARM_STATUSES and _normalize_kickoff(match.get('date')) > now]
+    return sorted(upcoming, key=lambda match: _normalize_kickoff(match.get('date')))
+
+def _prewarm_task(model_choice, prompt, api_key, deadline):
+    """Generuje i zapisuje jedną analizę; zwraca (błąd albo None, czas upstreamu w ms)."""
+    started = time.monotonic()
+    key = _analysis_cache_key(model_choice, prompt, False)
     try:
-        print(f"Rozpoczynam analizę z modelem: {model_choice}")
-        
-        if model_choice == 'gemini':
-            # Najpierw spróbuj pobrać klucz API z zmiennych środowiskowych Vercel
-            gemini_api_key = os.environ.get('GEMINI_API_KEY')
-            print(f"Backend: GEMINI_API_KEY z env: {'[UKRYTO]' if gemini_api_key else 'Brak'}")
-            
-            if not gemini_api_key:
-                # Jeśli klucz nie jest ustawiony w zmiennych środowiskowych, pobierz go z frontendu
-                gemini_api_key = body.get('geminiApiKey')
-                print(f"Backend: GEMINI_API_KEY z frontendu: {'[UKRYTO]' if gemini_api_key else 'Brak'}")
-                if not gemini_api_key:
-                    return jsonify({"error": "Brak klucza API dla Gemini. Upewnij się, że został dodany w ustawieniach lub w zmiennych środowiskowych Vercel."}), 400
-            if not GOOGLE_AI_AVAILABLE:
-                return jsonify({"error": "Biblioteki Google AI nie są dostępne. Sprawdź konfigurację serwera."}), 503
-            
-            # Sprawdź czy grounding jest włączony przez użytkownika
-            use_grounding = body.get('useGrounding', False)
-            if use_grounding:
-                print("UWAGA: Grounding search włączony - może to potrwać do 60 sekund")
-            
-            response_data = _call_gemini_api(prompt, gemini_api_key, use_grounding)
-            
-        elif model_choice == 'perplexity':
-            # Najpierw spróbuj pobrać klucz API z zmiennych środowiskowych Vercel
-            perplexity_api_key = os.environ.get('PERPLEXITY_API_KEY')
-            print(f"Backend: PERPLEXITY_API_KEY z env: {'[UKRYTO]' if perplexity_api_key else 'Brak'}")
-
-            if not perplexity_api_key:
-                # Jeśli klucz nie jest ustawiony w zmiennych środowiskowych, pobierz go z frontendu
-                perplexity_api_key = body.get('perplexityApiKey')
-                print(f"Backend: PERPLEXITY_API_KEY z frontendu: {'[UKRYTO]' if perplexity_api_key else 'Brak'}")
-                if not perplexity_api_key:
-                    return jsonify({"error": "Brak klucza API dla Perplexity. Upewnij się, że został dodany w ustawieniach lub w zmiennych środowiskowych Vercel."}), 400
-            response_data = _call_perplexity_api(prompt, perplexity_api_key)
-        else:
-            return jsonify({"error": "Nieprawidłowy model. Dostępne opcje: 'gemini', 'perplexity'."}), 400
-            
-        print("Analiza zakończona pomyślnie")
-        return jsonify(response_data)
-
-    except google_exceptions.PermissionDenied:
-        return jsonify({"error": "Błąd API Gemini: Nieprawidłowy klucz API lub brak uprawnień."}), 403
-    except google_exceptions.NotFound as e:
-        return jsonify({"error": f"Błąd API Gemini: Nie znaleziono zasobu (np. modelu). Sprawdź poprawność nazwy. Szczegóły: {e}"}), 404
-    except google_exceptions.InvalidArgument:
-         return jsonify({"error": "Błąd API Gemini: Nieprawidłowy argument, sprawdź poprawność promptu."}), 400
-    except requests.exceptions.Timeout:
-        return jsonify({"error": "Zapytanie przekroczyło limit czasu. Spróbuj ponownie lub użyj Perplexity dla szybszej odpowiedzi."}), 408
-    except requests.exceptions.ConnectionError:
-        return jsonify({"error": "Błąd połączenia z API. Sprawdź połączenie internetowe i spróbuj ponownie."}), 503
-    except requests.exceptions.HTTPError as e:
-        if e.response.status_code in [401, 403]:
-            return jsonify({"error": "Błąd API Perplexity: Nieprawidłowy klucz API lub brak uprawnień."}), 403
-        return jsonify({"error": f"Błąd API Perplexity: {e.response.status_code} - {e.response.text}"}), e.response.status_code
-    except generation_types.BlockedPromptException as e:
-        return jsonify({"error": f"Twoje zapytanie zostało zablokowane przez API. {e}"}), 400
+        response_data = _call_model_limited(model_choice, prompt, api_key, False, deadline)
     except Exception as e:
-        error_msg = str(e)
-        if "timeout" in error_msg.lower():
-            return jsonify({"error": "Zapytanie przekroczyło limit czasu. Spróbuj ponownie lub użyj Perplexity dla szybszej odpowiedzi."}), 408
-        elif "failed to fetch" in error_msg.lower():
-            return jsonify({"error": "Błąd połączenia. Sprawdź połączenie internetowe i spróbuj ponownie."}), 503
-        print(f"Nieoczekiwany błąd: {error_msg}")
-        return jsonify({"error": f"Wystąpił nieoczekiwany błąd serwera: {error_msg}"}), 500
+        return _analysis_error(e)[0], _elapsed_ms(started)
+    _analysis_cache.set(key, response_data)
+    _prewarmed_analyses.set(key, response_data)
+    return None, _elapsed_ms(started)
+
+def _run_prewarm(models=None, concurrency=PREWARM_CONCURRENCY, max_calls=PREWARM_MAX_CALLS, timeout=PREWARM_TIMEOUT):
+    """Generuje szybkie analizy dzisiejszych meczów; zwraca raport albo None, jeśli pre-warm już trwa.
+
+    Analiza jest generowana ponownie tylko wtedy, gdy zmienił się jej prompt (dane meczu lub dane o formie),
+    bo klucz zapisanego wyniku to ten sam klucz cache, którego używa /api/analyze.
+    """
+    global _prewarm_report
+    if not _prewarm_lock.acquire(blocking=False):
+        return None
+    try:
+        started = time.monotonic()
+        deadline = started + timeout
+        today_str = date.today().strftime('%Y-%m-%d')
+        matches = _get_matches_cached(today_str)[0]['matches']
+        if ENRICHMENT_ENABLED:
+            # Prompty muszą zawierać te same dane o formie, które zobaczą późniejsze kliknięcia użytkowników;
+            # na dane czekamy najwyżej PREWARM_ENRICHMENT_TIMEOUT, żeby został czas na analizy
+            _await_enrichment(matches, min(deadline, started + PREWARM_ENRICHMENT_TIMEOUT))
+        candidates = _prewarm_candidates(matches)
+
+        report = {'date': today_str, 'analysis_type': PREWARM_ANALYSIS_TYPE, 'fixtures': len(candidates),
+                  'models': {}, 'generated': 0, 'unchanged': 0, 'skipped_budget': 0, 'failed': [], 'upstream_ms': 0}
+        tasks = []
+        for model_choice in models or PREWARM_MODELS:
+            # Cron nie ma kluczy z przeglądarki - tylko klucze ze zmiennych środowiskowych
+            api_key = os.environ.get('GEMINI_API_KEY' if model_choice == 'gemini' else 'PERPLEXITY_API_KEY')
+            if model_choice not in PROVIDER_LIMITS or not api_key or (model_choice == 'gemini' and not GOOGLE_AI_AVAILABLE):
+                report['models'][model_choice] = 'skipped: brak klucza API lub nieobsługiwany model'
+                continue
+            report['models'][model_choice] = 'ok'
+            for match in candidates:
+                prompt = _build_prompt(match, PREWARM_ANALYSIS_TYPE, model_choice)
+                if _prewarmed_analysis(_analysis_cache_key(model_choice, prompt, False)) is not None:
+                    report['unchanged'] += 1
+                elif len(tasks) >= max_calls:
+                    report['skipped_budget'] += 1
+                else:
+                    tasks.append((match, model_choice, prompt, api_key))
+
+        pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='prewarm')
+        futures = [(match, model_choice, pool.submit(_prewarm_task, model_choice, prompt, api_key, deadline))
+                   for match, model_choice, prompt, api_key in tasks]
+        for match, model_choice, future in futures:
+            try:
+                error, upstream_ms = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FuturesTimeoutError:
+                future.cancel()
+                error, upstream_ms = f"Przekroczony limit czasu pre-warmu ({timeout:.0f}s).", 0
+            report['upstream_ms'] += upstream_ms
+            if error:
+                report['failed'].append({'match': _match_summary(match), 'model': model_choice, 'error': error})
+            else:
+                report['generated'] += 1
+        pool.shutdown(wait=False, cancel_futures=True)
+
+        total = report['generated'] + report['unchanged'] + report['skipped_budget'] + len(report['failed'])
+        # Bez żadnego dostępnego modelu pokrycie jest zerowe, o ile są mecze do przygotowania
+        report['coverage'] = round((report['generated'] + report['unchanged']) / total, 3) if total else float(not candidates)
+        report['duration_ms'] = _elapsed_ms(started)
+        for outcome in ('generated', 'unchanged', 'skipped_budget'):
+            _metrics.inc('prewarm_analyses_total', report[outcome], outcome=outcome)
+        _metrics.inc('prewarm_analyses_total', len(report['failed']), outcome='failed')
+        print(f"Pre-warm {today_str}: wygenerowano {report['generated']}, bez zmian {report['unchanged']}, "
+              f"błędy {len(report['failed'])}, pokrycie {report['coverage']:.0%}, upstream {report['upstream_ms']} ms")
+        _prewarm_report = {**report, 'finished_at': int(time.time())}
+        return report
+    finally:
+        _prewarm_lock.release()
+
+@app.route('/api/cron/prewarm', methods=['GET', 'POST'])
+def cron_prewarm():
+    """Pre-warm wywoływany przez Vercel Cron - wymaga nagłówka Authorization: Bearer <CRON_SECRET>."""
+    secret = os.environ.get('CRON_SECRET')
+    if not secret:
+        return jsonify({'error': 'Pre-warm jest wyłączony - ustaw zmienną środowiskową CRON_SECRET.'}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {secret}"):
+        return jsonify({'error': 'Brak autoryzacji.'}), 401
+    report = _run_prewarm()
+    if report is None:
+        return jsonify({'error': 'Pre-warm już trwa.', 'last_report': _prewarm_report}), 409
+    return jsonify(report)
+
+# Zadania analizy w tle: liczba wątków roboczych i czas przechowywania wyników (w sekundach)
+JOB_MAX_WORKERS = int(os.environ.get('JOB_MAX_WORKERS', '4'))
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', '3600'))
+JOB_MAX_ENTRIES = int(os.environ.get('JOB_MAX_ENTRIES', '512'))
+# Maksymalny czas (w sekundach) długiego odpytywania GET /api/jobs/<id>?wait=N
+JOB_MAX_WAIT = float(os.environ.get('JOB_MAX_WAIT', '25'))
+# Co ile sekund proces odnawia heartbeat_at swoich niezakończonych zadań; zadanie bez heartbeatu
+# przez JOB_STALE_AFTER sekund (np. po restarcie procesu) jest zgłaszane jako błąd zamiast wiecznego 'running'
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', '10'))
+JOB_STALE_AFTER = float(os.environ.get('JOB_STALE_AFTER', '60'))
+_job_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix='analysis-job')
+# Retencja liczona od ostatniej zmiany stanu zadania, więc gotowy wynik żyje JOB_RETENTION od zakończenia
+_jobs = _TTLCache(JOB_RETENTION, _open_store('analysis_jobs'), max_entries=JOB_MAX_ENTRIES)
+# Zadania w toku: klucz analizy -> id zadania (to samo zapytanie nie jest uruchamiane drugi raz)
+_active_jobs = {}
+_job_events = {}
+_jobs_lock = threading.Lock()
+_job_heartbeat_thread = None
+
+def _public_job(job):
+    return {key: value for key, value in job.items() if key != 'cache_key'}
+
+def _get_job(job_id):
+    entry = _jobs.get(job_id)
+    if entry is None or not _jobs.is_fresh(entry[1]):
+        return None
+    job = entry[0]
+    # Zadanie z magazynu SQLite, którego wątek roboczy już nie istnieje (restart, inna zatrzymana instancja)
+    if (job['status'] in ('queued', 'running') and job_id not in _job_events
+            and time.time() - job.get('heartbeat_at', job['created_at']) > JOB_STALE_AFTER):
+        return {**job, 'status': 'error', 'status_code': 503,
+                'error': 'Zadanie analizy zostało przerwane (serwer został zrestartowany). Spróbuj ponownie.'}
+    return job
+
+def _job_heartbeat():
+    """Odnawia heartbeat_at zadań tego procesu - inne instancje widzą, że zadanie wciąż trwa."""
+    while True:
+        time.sleep(JOB_HEARTBEAT_INTERVAL)
+        with _jobs_lock:
+            for job_id in list(_job_events):
+                entry = _jobs.get(job_id)
+                if entry is not None and entry[0]['status'] in ('queued', 'running'):
+                    _jobs.set(job_id, {**entry[0], 'heartbeat_at': time.time()})
+
+def _ensure_job_heartbeat():
+    global _job_heartbeat_thread
+    with _jobs_lock:
+        if _job_heartbeat_thread is None:
+            _job_heartbeat_thread = threading.Thread(target=_job_heartbeat, name='job-heartbeat', daemon=True)
+            _job_heartbeat_thread.start()
+
+def _run_analysis_job(job, prompt, api_key, alternate=None):
+    # Zmiany stanu pod _jobs_lock, żeby heartbeat nie nadpisał ich starszą kopią zadania
+    with _jobs_lock:
+        job = _jobs.set(job['job_id'], {**job, 'status': 'running', 'started_at': time.time(),
+                                        'heartbeat_at': time.time()})[0]
+    try:
+        response_data, cache_info = _cached_analysis(
+            _analysis_cache_model(job['model'], alternate), prompt, job['use_grounding'],
+            lambda: _call_model_hedged(job['model'], prompt, api_key, job['use_grounding'], alternate))
+        job = {**job, 'status': 'done', 'result': response_data, 'cache': cache_info}
+        print(f"Zadanie {job['job_id']} zakończone pomyślnie")
+    except Exception as e:
+        message, status = _analysis_error(e)
+        job = {**job, 'status': 'error', 'error': message, 'status_code': status}
+        print(f"Zadanie {job['job_id']} zakończone błędem: {message}")
+    job['finished_at'] = time.time()
+    with _jobs_lock:
+        _jobs.set(job['job_id'], job)
+        _active_jobs.pop(job['cache_key'], None)
+        event = _job_events.pop(job['job_id'], None)
+    if event is not None:
+        event.set()
+
+def _submit_analysis_job(model_choice, prompt, api_key, use_grounding, alternate=None):
+    """Tworzy zadanie analizy albo zwraca trwające zadanie dla identycznego zapytania."""
+    cache_key = _analysis_cache_key(_analysis_cache_model(model_choice, alternate), prompt, use_grounding)
+    with _jobs_lock:
+        job_id = _active_jobs.get(cache_key)
+        job = _get_job(job_id) if job_id else None
+        if job is not None:
+            return job
+        job_id = uuid.uuid4().hex
+        job = {'job_id': job_id, 'status': 'queued', 'model': model_choice, 'use_grounding': use_grounding,
+               'hedge': alternate is not None, 'cache_key': cache_key, 'created_at': time.time(),
+               'heartbeat_at': time.time()}
+        _jobs.set(job_id, job)
+        _active_jobs[cache_key] = job_id
+        _job_events[job_id] = threading.Event()
+
+    if _jobs.store is not None:
+        try:
+            _jobs.store.purge_older_than(time.time() - JOB_RETENTION)
+        except sqlite3.Error as e:
+            print(f"Błąd czyszczenia zadań SQLite: {e}")
+    print(f"Nowe zadanie analizy {job_id} ({model_choice})")
+    _ensure_job_heartbeat()
+    _job_executor.submit(_run_analysis_job, job, prompt, api_key, alternate)
+    return job
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Stan zadania analizy. ?wait=N czeka do N sekund na zakończenie (długie odpytywanie)."""
+    try:
+        wait_s = min(float(request.args.get('wait', 0)), JOB_MAX_WAIT)
+    except ValueError:
+        wait_s = 0
+    if wait_s > 0:
+        with _jobs_lock:
+            event = _job_events.get(job_id)
+        if event is not None:
+            event.wait(wait_s)
+
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Nie znaleziono zadania (mogło wygasnąć).'}), 404
+    return jsonify(_public_job(job))
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Stan instancji: pule połączeń do upstreamów, czasy odpowiedzi modeli i stan bezpieczników."""
+    return jsonify({
+        'status': 'ok',
+        'upstreams': {
+            client.name: client.stats() for client in (_football_data_client, _openligadb_client, _perplexity_client)
+        },
+        'latency': _latency_stats(),
+        'breakers': _breaker_states(),
+        'enrichment': {'prefetching': _enrichment_inflight is not None, 'last_prefetch': _enrichment_report},
+        'prewarm': {'running': _prewarm_lock.locked(), 'last_report': _prewarm_report},
+        'startup': _startup_report or {'import_ms': STARTUP_IMPORT_MS, 'google_ai_loaded': genai is not None},
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Histogramy czasów i liczniki błędów w formacie tekstowym Prometheusa (do scrapowania)."""
+    return Response(_metrics.render(), mimetype='text/plain; version=0.0.4', headers={'Cache-Control': 'no-store'})
 
 @app.errorhandler(500)
 def internal_error(error):
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Powtarzalny benchmark /api/get-matches i /api/analyze bez prawdziwych API.
+
+Skrypt uruchamia lokalną atrapę football-data.org, OpenLigaDB, Gemini i Perplexity
+(konfigurowalne opóźnienie, odsetek błędów 5xx oraz limity zapytań football-data.org
+i modeli z odpowiedziami 429),
+a następnie dla każdego scenariusza i poziomu równoległości startuje świeży proces
+aplikacji Flask (pusty cache) i wysyła do niego --requests zapytań.
+
+Atrapy football-data.org i OpenLigaDB odtwarzają mecze z football_matches_20250823.json
+w formatach ich API, a modele zwracają stałe odpowiedzi. Raport zawiera
+p50/p95/p99, req/s, kody odpowiedzi i liczbę wywołań każdego upstreamu.
+
+Przykład: python benchmark.py --concurrency 1,10,50 --upstream-latency 0.2 --output wyniki.json
+          python benchmark.py --compare wyniki_przed.json wyniki_po.json
+Wymaga: pip install -r requirements-asgi.txt (httpx)
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+
+from load_test import free_port, serve_wsgi, start_process
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_PATH = os.path.join(ROOT_DIR, 'football_matches_20250823.json')
+
+SCENARIOS = ('get-matches', 'analyze-perplexity', 'analyze-gemini')
+
+# Kody rozgrywek football-data.org dla lig z pliku z przykładowymi meczami
+LEAGUE_CODES = {
+    'Premier League': 'PL', 'La Liga': 'PD', 'Serie A': 'SA', 'Bundesliga': 'BL1',
+    '2. Bundesliga': 'BL2', 'Ligue 1': 'FL1', 'Primeira Liga': 'PPL',
+}
+CANNED_TEXT = "**Prognoza:** 2:1 dla gospodarzy. Analiza testowa z atrapy upstreamu."
+
+class FakeUpstream:
+    """Atrapa football-data.org (/v4/...), OpenLigaDB (/openligadb/...), Perplexity i Gemini."""
+
+    def __init__(self, latency, error_rate, rate_per_minute, copies, model_rate_per_minute=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        # Limity na minutę dla każdego upstreamu (0 = bez limitu); OpenLigaDB nie ma limitu
+        self.rate_limits = {'football-data': rate_per_minute, 'perplexity': model_rate_per_minute,
+                            'gemini': model_rate_per_minute}
+        with open(FIXTURE_PATH, encoding='utf-8') as f:
+            self.fixture = json.load(f) * copies
+        self.reset()
+
+    def reset(self):
+        self.calls = {'football-data': 0, 'openligadb': 0, 'perplexity': 0, 'gemini': 0}
+        self.errors = {'football-data': 0, 'openligadb': 0, 'perplexity': 0, 'gemini': 0}
+        self.rate_limited = {'football-data': 0, 'perplexity': 0, 'gemini': 0}
+        self._windows = {}
+
+    def football_data_matches(self, query):
+        day = query.get('dateFrom', [time.strftime('%Y-%m-%d')])[0]
+        codes = set(query['competitions'][0].split(',')) if 'competitions' in query else None
+        matches = []
+        for i, fixture in enumerate(self.fixture):
+            code = LEAGUE_CODES.get(fixture['league'], 'OTHER')
+            if codes is not None and code not in codes:
+                continue
+            matches.append({
+                'id': 500000 + i,
+                'utcDate': f"{day}T{fixture['date'].split('T')[1].rstrip('Z')}Z",
+                'status': fixture['status'].upper(),
+                'competition': {'code': code, 'name': fixture['league']},
+                'homeTeam': {'id': 1000 + 2 * i, 'name': fixture['home_team']},
+                'awayTeam': {'id': 1001 + 2 * i, 'name': fixture['away_team']},
+                'score': {'fullTime': {'home': None, 'away': None}},
+            })
+        return {'filters': {'dateFrom': day, 'dateTo': day}, 'resultSet': {'count': len(matches)}, 'matches': matches}
+
+    def openligadb_matches(self, shortcut):
+        """Bieżąca kolejka ligi w formacie /getmatchdata/<liga> - mecze z pliku pochodzące z OpenLigaDB."""
+        day = time.strftime('%Y-%m-%d')  # jak date.today() w aplikacji
+        league = {'bl1': 'Bundesliga', 'bl2': '2. Bundesliga'}.get(shortcut)
+        return [{
+            'matchID': 70000 + i,
+            'matchDateTimeUTC': f"{day}T{fixture['date'].split('T')[1].rstrip('Z')}Z",
+            'leagueName': fixture['league'],
+            'team1': {'teamName': fixture['home_team']},
+            'team2': {'teamName': fixture['away_team']},
+            'matchIsFinished': False,
+        } for i, fixture in enumerate(self.fixture) if fixture['league'] == league and fixture['source'] == 'OpenLigaDB']
+
+    def _rate_limit_headers(self, upstream):
+        """Okno minutowe upstreamu: zwraca (czy przekroczono, nagłówki).
+
+        football-data.org dostaje nagłówki X-Requests-Available-Minute / X-RequestCounter-Reset,
+        modele - Retry-After przy odpowiedzi 429.
+        """
+        limit = self.rate_limits.get(upstream)
+        if not limit:
+            return False, {}
+        now = time.monotonic()
+        window_started, used = self._windows.get(upstream, (now, 0))
+        if now - window_started >= 60:
+            window_started, used = now, 0
+        exceeded = used >= limit
+        if not exceeded:
+            used += 1
+        self._windows[upstream] = (window_started, used)
+        reset = str(max(1, round(60 - (now - window_started))))
+        if upstream != 'football-data':
+            return exceeded, {'Retry-After': reset} if exceeded else {}
+        return exceeded, {'X-Requests-Available-Minute': str(max(0, limit - used)), 'X-RequestCounter-Reset': reset}
+
+    async def handle(self, method, path, query):
+        """Zwraca (status, nagłówki, ciało JSON) dla zapytania."""
+        if path == '/stats':
+            return 200, {}, {'calls': self.calls, 'errors': self.errors, 'rate_limited': self.rate_limited}
+        if path == '/reset':
+            self.reset()
+            return 200, {}, {'ok': True}
+
+        if path.startswith('/v4/'):
+            upstream = 'football-data'
+        elif path.startswith('/openligadb/'):
+            upstream = 'openligadb'
+        elif path.endswith('/chat/completions'):
+            upstream = 'perplexity'
+        elif ':generateContent' in path:
+            upstream = 'gemini'
+        else:
+            return 404, {}, {'error': 'Not found'}
+
+        self.calls[upstream] += 1
+        exceeded, headers = self._rate_limit_headers(upstream)
+        if exceeded:
+            self.rate_limited[upstream] += 1
+            if upstream == 'football-data':
+                return 429, headers, {'message': 'You reached your request limit.', 'errorCode': 429}
+            if upstream == 'perplexity':
+                return 429, headers, {'error': {'message': 'Rate limit exceeded', 'type': 'rate_limit_exceeded', 'code': 429}}
+            return 429, headers, {'error': {'code': 429, 'message': 'Resource has been exhausted (e.g. check quota).',
+                                            'status': 'RESOURCE_EXHAUSTED'}}
+        await asyncio.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self.errors[upstream] += 1
+            return 500, headers, {'error': 'Błąd wstrzyknięty przez atrapę'}
+
+        if upstream == 'football-data':
+            if '/competitions/' in path:
+                query = dict(query, competitions=[path.split('/competitions/')[1].split('/')[0]])
+            return 200, headers, self.football_data_matches(query)
+        if upstream == 'openligadb':
+            return 200, headers, self.openligadb_matches(path.rsplit('/', 1)[1])
+        if upstream == 'perplexity':
+            return 200, headers, {'choices': [{'message': {'role': 'assistant', 'content': CANNED_TEXT}}]}
+        return 200, headers, {'candidates': [{'content': {'parts': [{'text': CANNED_TEXT}], 'role': 'model'},
+                                              'finishReason': 'STOP', 'index': 0}]}
+
+def serve_fake_upstream(port, latency, error_rate, rate_per_minute, copies, model_rate_per_minute=0):
+    """Serwer HTTP/1.1 atrapy na asyncio - setki równoległych połączeń bez puli wątków."""
+    fake = FakeUpstream(latency, error_rate, rate_per_minute, copies, model_rate_per_minute)
+    reasons = {200: 'OK', 404: 'Not Found', 429: 'Too Many Requests', 500: 'Internal Server Error'}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                method, target, _ = request_line.split(' ', 2)
+                length = 0
+                for line in header_lines:
+                    if line.lower().startswith('content-length:'):
+                        length = int(line.split(':', 1)[1])
+                await reader.readexactly(length)
+                url = urlsplit(target)
+                status, headers, payload = await fake.handle(method, url.path, parse_qs(url.query))
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                head_out = [f"HTTP/1.1 {status} {reasons.get(status, 'OK')}", 'Content-Type: application/json',
+                            f"Content-Length: {len(body)}"] + [f"{name}: {value}" for name, value in headers.items()]
+                writer.write(('\r\n'.join(head_out) + '\r\n\r\n').encode('latin-1') + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handle, '127.0.0.1', port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+def scenario_request(scenario, i, distinct_prompts):
+    """Zwraca (metoda, ścieżka, body) i-tego zapytania scenariusza."""
+    if scenario == 'get-matches':
+        return 'GET', '/api/get-matches', None
+    # Przy --distinct-prompts N zapytania powtarzają N promptów (trafienia w cache wyników)
+    n = i % distinct_prompts if distinct_prompts else f"{i}-{time.time_ns()}"
+    prompt = f"Przeanalizuj mecz piłkarski #{n}: Arsenal vs Chelsea, Premier League."
+    return 'POST', '/api/analyze', {'prompt': prompt, 'model': scenario.split('-', 1)[1]}
+
+async def run_level(port, scenario, concurrency, total, timeout, distinct_prompts):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=timeout, limits=limits) as client:
+        async def one(i):
+            method, path, body = scenario_request(scenario, i, distinct_prompts)
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(total)))
+        return results, time.perf_counter() - started
+
+def upstream_stats(upstream_port):
+    return httpx.get(f'http://127.0.0.1:{upstream_port}/stats').json()
+
+def summarize(scenario, concurrency, results, wall, stats):
+    latencies = sorted(latency for status, latency in results if status == 200)
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1) if latencies else None
+
+    return {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': len(results),
+        'ok': len(latencies),
+        'statuses': statuses,
+        'wall_s': round(wall, 3),
+        'rps': round(len(latencies) / wall, 1) if wall else 0,
+        'p50_ms': pct(0.50),
+        'p95_ms': pct(0.95),
+        'p99_ms': pct(0.99),
+        'upstream_calls': stats['calls'],
+        'upstream_errors': stats['errors'],
+        'upstream_rate_limited': stats['rate_limited'],
+    }
+
+def print_table(rows):
+    print(f"\n{'scenariusz':<20}{'równ.':>6}{'ok':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  wywołania upstreamu")
+    for row in rows:
+        calls = ', '.join(f"{name}={count}" for name, count in row['upstream_calls'].items() if count)
+        print(f"{row['scenario']:<20}{row['concurrency']:>6}{row['ok']:>6}{row['rps']:>9}{str(row['p50_ms']):>9}"
+              f"{str(row['p95_ms']):>9}{str(row['p99_ms']):>9}  {calls or '-'}")
+
+def compare(before_path, after_path):
+    """Porównuje dwa zapisane wyniki (req/s i p95) dla wspólnych par scenariusz x równoległość."""
+    def load(path):
+        with open(path, encoding='utf-8') as f:
+            return {(row['scenario'], row['concurrency']): row for row in json.load(f)['results']}
+
+    before, after = load(before_path), load(after_path)
+    print(f"{'scenariusz':<20}{'równ.':>6}{'req/s przed':>13}{'po':>9}{'p95 przed':>11}{'po':>9}")
+    for key in sorted(before.keys() & after.keys()):
+        b, a = before[key], after[key]
+        print(f"{key[0]:<20}{key[1]:>6}{b['rps']:>13}{a['rps']:>9}{str(b['p95_ms']):>11}{str(a['p95_ms']):>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,10,50', help='poziomy równoległości, np. 1,10,50')
+    parser.add_argument('--requests', type=int, default=200, help='liczba zapytań na poziom')
+    parser.add_argument('--threads', type=int, default=16, help='wątki serwera WSGI aplikacji')
+    parser.add_argument('--upstream-latency', type=float, default=0.1, help='opóźnienie atrapy (s)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='odsetek odpowiedzi 500 atrapy (0-1)')
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='limit zapytań football-data.org na minutę, po którym atrapa zwraca 429 (0 = bez limitu)')
+    parser.add_argument('--model-rate-limit', type=int, default=0,
+                        help='limit zapytań na minutę osobno dla Gemini i Perplexity, po którym atrapa zwraca 429 (0 = bez limitu)')
+    parser.add_argument('--fixture-copies', type=int, default=1, help='ile razy powielić mecze z pliku (większy payload)')
+    parser.add_argument('--distinct-prompts', type=int, default=0,
+                        help='liczba różnych promptów w scenariuszach analyze (0 = każdy inny, bez trafień w cache)')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=0, help='ziarno losowania błędów atrapy')
+    parser.add_argument('--output', help='zapisz wyniki jako JSON')
+    parser.add_argument('--compare', nargs=2, metavar=('PRZED', 'PO'), help='porównaj dwa pliki wyników')
+    parser.add_argument('--serve-wsgi', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--serve-upstream', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.serve_wsgi:
+        return serve_wsgi(args.serve_wsgi, args.threads)
+    if args.serve_upstream:
+        random.seed(args.seed)
+        return serve_fake_upstream(args.serve_upstream, args.upstream_latency, args.error_rate,
+                                   args.rate_limit, args.fixture_copies, args.model_rate_limit)
+
+    upstream_port = free_port()
+    upstream = start_process('upstream', [
+        sys.executable, __file__, '--serve-upstream', str(upstream_port),
+        '--upstream-latency', str(args.upstream_latency), '--error-rate', str(args.error_rate),
+        '--rate-limit', str(args.rate_limit), '--model-rate-limit', str(args.model_rate_limit),
+        '--fixture-copies', str(args.fixture_copies), '--seed', str(args.seed),
+    ], upstream_port)
+    upstream_url = f'http://127.0.0.1:{upstream_port}'
+    env = dict(os.environ,
+               VERCEL='1',  # bez wczytywania lokalnego .env z prawdziwymi kluczami
+               FOOTBALL_DATA_API_URL=f'{upstream_url}/v4',
+               FOOTBALL_DATA_API_KEY='benchmark',
+               OPENLIGADB_API_URL=f'{upstream_url}/openligadb',
+               PERPLEXITY_API_URL=f'{upstream_url}/chat/completions',
+               PERPLEXITY_API_KEY='benchmark',
+               GEMINI_API_ENDPOINT=upstream_url,
+               GEMINI_API_KEY='benchmark',
+               CACHE_DB_PATH='',
+               # Pobieranie formy drużyn w tle zużywałoby limit atrapy football-data.org w scenariuszu get-matches
+               ENRICHMENT_ENABLED='0',
+               HTTP_POOL_SIZE=str(max(args.threads, 10)),
+               PYTHONUNBUFFERED='1')
+
+    report = []
+    try:
+        for scenario in args.scenarios.split(','):
+            for concurrency in (int(level) for level in args.concurrency.split(',')):
+                # Świeży proces aplikacji dla każdego poziomu - cache i limitery startują od zera
+                httpx.post(f'{upstream_url}/reset')
+                port = free_port()
+                app_process = start_process('app', [sys.executable, __file__, '--serve-wsgi', str(port),
+                                                    '--threads', str(args.threads)], port, env)
+                try:
+                    results, wall = asyncio.run(run_level(port, scenario, concurrency, args.requests,
+                                                          args.timeout, args.distinct_prompts))
+                finally:
+                    app_process.terminate()
+                    app_process.wait(timeout=10)
+                row = summarize(scenario, concurrency, results, wall, upstream_stats(upstream_port))
+                report.append(row)
+                print(f"{scenario} x{concurrency}: {row['rps']} req/s, p95 {row['p95_ms']} ms, kody {row['statuses']}")
+    finally:
+        upstream.terminate()
+
+    print_table(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'params': vars(args), 'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': report},
+                      f, indent=2, ensure_ascii=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Kontrola czasu zimnego startu api/index.py (do uruchamiania w CI).
+
+Każdy pomiar to świeży proces z STARTUP_PROFILE=1, który importuje aplikację
+i obsługuje jedno zapytanie. Skrypt kończy się kodem 1, jeśli mediana czasu
+do pierwszego zapytania przekracza budżet albo jeśli import aplikacji
+załadował biblioteki Google AI (powinny ładować się dopiero przy analizie Gemini).
+
+Przykład: python check_startup.py --runs 5 --budget-ms 800
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PROBE = """
+import json, sys
+from api import index
+index.app.test_client().get(sys.argv[1])
+print('STARTUP_REPORT ' + json.dumps(index._startup_report))
+"""
+
+def measure(path):
+    env = dict(os.environ, STARTUP_PROFILE='1', VERCEL='1', PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', PROBE, path], cwd=ROOT_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    for line in result.stdout.splitlines():
+        if line.startswith('STARTUP_REPORT '):
+            return json.loads(line[len('STARTUP_REPORT '):])
+    raise RuntimeError(f"Brak raportu startu w wyjściu:\n{result.stdout}\n{result.stderr}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', '1500')))
+    parser.add_argument('--path', default='/api/check-env-keys', help='pierwsze zapytanie po starcie')
+    parser.add_argument('--top', type=int, default=10, help='ile najwolniejszych modułów pokazać')
+    args = parser.parse_args()
+
+    reports = [measure(args.path) for _ in range(args.runs)]
+    first_request_ms = statistics.median(report['time_to_first_request_ms'] for report in reports)
+    import_ms = statistics.median(report['import_ms'] for report in reports)
+
+    print(f"Import aplikacji: {import_ms:.0f} ms, czas do pierwszego zapytania: {first_request_ms:.0f} ms "
+          f"(mediana z {args.runs}, budżet {args.budget_ms:.0f} ms)")
+    print("Najwolniejsze moduły (ostatni pomiar):")
+    for module in reports[-1]['slowest_modules'][:args.top]:
+        print(f"  {module['self_ms']:>8.1f} ms  {module['module']}")
+
+    failed = False
+    if any(report['google_ai_loaded'] for report in reports):
+        print("❌ Biblioteki Google AI zostały załadowane podczas startu - powinny ładować się leniwie.")
+        failed = True
+    if first_request_ms > args.budget_ms:
+        print(f"❌ Przekroczony budżet zimnego startu o {first_request_ms - args.budget_ms:.0f} ms.")
+        failed = True
+    if not failed:
+        print("✅ Zimny start w budżecie.")
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Test obciążeniowy: ile równoległych analiz obsłuży jeden proces w trybie WSGI (Flask) i ASGI.
+
+Skrypt uruchamia lokalną atrapę API Perplexity z zadanym opóźnieniem, a następnie
+ten sam zestaw zapytań /api/analyze wysyła do:
+  - wsgi: aplikacji Flask na serwerze z pulą --threads wątków (jak gunicorn gthread),
+  - asgi: api.asgi:app na uvicorn (jeden proces, jedna pętla zdarzeń).
+
+Przykład: python load_test.py --concurrency 200 --threads 8 --upstream-latency 1
+Wymaga: pip install -r requirements-asgi.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def serve_fake_perplexity(port, latency):
+    """Atrapa /chat/completions odpowiadająca po `latency` sekundach.
+
+    Działa na asyncio w osobnym procesie, żeby sama nie ograniczała liczby
+    równoległych połączeń ani nie zabierała czasu procesora klientowi testu.
+    """
+    body = json.dumps({'choices': [{'message': {'content': 'Analiza testowa'}}]}).encode()
+    response = (b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = 0
+                for line in head.split(b'\r\n'):
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                await reader.readexactly(length)
+                await asyncio.sleep(latency)
+                writer.write(response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handle, '127.0.0.1', port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+class PooledWSGIServer(WSGIServer):
+    """Serwer WSGI ze stałą pulą wątków - limit równoległości jak w typowym wdrożeniu synchronicznym."""
+    request_queue_size = 1024
+
+    def __init__(self, *args, threads=8, **kwargs):
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+def serve_wsgi(port, threads):
+    sys.path.insert(0, ROOT_DIR)
+    from api.index import app
+    server = make_server('127.0.0.1', port, app, server_class=lambda *a, **kw: PooledWSGIServer(*a, threads=threads, **kw),
+                         handler_class=QuietHandler)
+    server.serve_forever()
+
+def start_process(name, command, port, env=None):
+    process = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Proces {name} nie wystartował na porcie {port}")
+
+def start_server(mode, port, threads, env):
+    if mode == 'wsgi':
+        command = [sys.executable, __file__, '--serve-wsgi', str(port), '--threads', str(threads)]
+    else:
+        command = [sys.executable, '-m', 'uvicorn', 'api.asgi:app', '--port', str(port), '--log-level', 'warning']
+    return start_process(mode, command, port, env)
+
+async def run_load(port, concurrency, timeout):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', timeout=timeout, limits=limits) as client:
+        async def one(i):
+            started = time.perf_counter()
+            try:
+                # Unikalny prompt - bez trafień w cache wyników
+                response = await client.post('/api/analyze', json={
+                    'prompt': f'Test obciążeniowy #{i} {time.time_ns()}', 'model': 'perplexity'})
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            return ok, time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(concurrency)))
+        return results, time.perf_counter() - started
+
+def summarize(mode, results, wall, upstream_latency, threads):
+    latencies = sorted(latency for ok, latency in results if ok)
+    ok_count = len(latencies)
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000) if latencies else None
+
+    return {
+        'mode': mode,
+        'threads': threads if mode == 'wsgi' else None,
+        'requests': len(results),
+        'ok': ok_count,
+        'errors': len(results) - ok_count,
+        'wall_s': round(wall, 2),
+        'rps': round(ok_count / wall, 1) if wall else 0,
+        'p50_ms': pct(0.50),
+        'p95_ms': pct(0.95),
+        'p99_ms': pct(0.99),
+        'mean_ms': round(statistics.mean(latencies) * 1000) if latencies else None,
+        # Ile wywołań upstreamu średnio trwało naraz - to jest faktyczna pojemność procesu
+        'effective_concurrency': round(ok_count * upstream_latency / wall, 1) if wall else 0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=200, help='liczba równoległych zapytań')
+    parser.add_argument('--threads', type=int, default=8, help='wątki serwera WSGI')
+    parser.add_argument('--upstream-latency', type=float, default=1.0, help='opóźnienie atrapy Perplexity (s)')
+    parser.add_argument('--modes', default='wsgi,asgi')
+    parser.add_argument('--timeout', type=float, default=120.0)
+    parser.add_argument('--output', help='zapisz wyniki jako JSON')
+    parser.add_argument('--serve-wsgi', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--serve-upstream', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_wsgi:
+        return serve_wsgi(args.serve_wsgi, args.threads)
+    if args.serve_upstream:
+        return serve_fake_perplexity(args.serve_upstream, args.upstream_latency)
+
+    upstream_port = free_port()
+    upstream = start_process('upstream', [sys.executable, __file__, '--serve-upstream', str(upstream_port),
+                                          '--upstream-latency', str(args.upstream_latency)], upstream_port)
+    env = dict(os.environ,
+               PERPLEXITY_API_URL=f'http://127.0.0.1:{upstream_port}/chat/completions',
+               PERPLEXITY_API_KEY='load-test',
+               HTTP_POOL_SIZE=str(max(args.threads, 10)),
+               PYTHONUNBUFFERED='1')
+
+    report = []
+    try:
+        for mode in args.modes.split(','):
+            port = free_port()
+            process = start_server(mode, port, args.threads, env)
+            try:
+                results, wall = asyncio.run(run_load(port, args.concurrency, args.timeout))
+            finally:
+                process.terminate()
+                process.wait(timeout=10)
+            report.append(summarize(mode, results, wall, args.upstream_latency, args.threads))
+    finally:
+        upstream.terminate()
+
+    print(f"\n{'tryb':<6}{'ok':>6}{'błędy':>7}{'czas s':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'równolegle':>12}")
+    for row in report:
+        print(f"{row['mode']:<6}{row['ok']:>6}{row['errors']:>7}{row['wall_s']:>9}{row['rps']:>8}"
+              f"{str(row['p50_ms']):>9}{str(row['p95_ms']):>9}{row['effective_concurrency']:>12}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'params': vars(args), 'results': report}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
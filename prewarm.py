@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Pre-warm dnia meczowego z linii poleceń (to samo co /api/cron/prewarm).
+
+Pobiera dzisiejsze mecze, generuje dla każdego szybką analizę modelami z PREWARM_MODELS
+(klucze API ze zmiennych środowiskowych) i zapisuje wyniki w cache analiz. Żeby serwer
+korzystał z wyników, musi współdzielić z tym procesem plik CACHE_DB_PATH.
+Ponowne uruchomienie generuje analizy tylko dla meczów, których dane się zmieniły.
+
+Przykład: CACHE_DB_PATH=cache.db python prewarm.py --concurrency 4 --max-calls 20
+Kod wyjścia 1 oznacza, że część analiz się nie udała.
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def main():
+    sys.path.insert(0, ROOT_DIR)
+    from api import index
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', default=','.join(index.PREWARM_MODELS), help='modele rozdzielone przecinkami')
+    parser.add_argument('--concurrency', type=int, default=index.PREWARM_CONCURRENCY)
+    parser.add_argument('--max-calls', type=int, default=index.PREWARM_MAX_CALLS, help='budżet wywołań modeli')
+    parser.add_argument('--timeout', type=float, default=index.PREWARM_TIMEOUT, help='łączny limit czasu (s)')
+    parser.add_argument('--output', help='zapisz raport jako JSON')
+    args = parser.parse_args()
+
+    report = index._run_prewarm([model.strip() for model in args.models.split(',') if model.strip()],
+                                args.concurrency, args.max_calls, args.timeout)
+    if report is None:
+        print("Pre-warm już trwa w tym procesie.")
+        sys.exit(1)
+
+    print(f"Mecze przed rozpoczęciem: {report['fixtures']}, modele: {report['models']}")
+    print(f"Wygenerowano: {report['generated']}, bez zmian: {report['unchanged']}, "
+          f"poza budżetem: {report['skipped_budget']}, błędy: {len(report['failed'])}")
+    print(f"Pokrycie: {report['coverage']:.0%}, czas upstreamu: {report['upstream_ms'] / 1000:.1f} s, "
+          f"całość: {report['duration_ms'] / 1000:.1f} s")
+    for failure in report['failed']:
+        match = failure['match']
+        print(f"  ❌ {match['home_team']} - {match['away_team']} ({failure['model']}): {failure['error']}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    sys.exit(1 if report['failed'] else 0)
+
+if __name__ == '__main__':
+    main()
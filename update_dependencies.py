@@ -21,7 +21,8 @@ def main():
     print("🔄 Aktualizacja zależności dla grounding search...")
     
     # Aktualizuj google-generativeai
-    if run_command("pip install --upgrade google-generativeai>=0.3.0"):
+    # Górna granica jak w requirements.txt (prywatne atrybuty klienta w _get_gemini_model)
+    if run_command("pip install --upgrade 'google-generativeai>=0.3.0,<0.9'"):
         print("✅ google-generativeai zaktualizowane")
     else:
         print("❌ Błąd aktualizacji google-generativeai")